@@ -9,16 +9,23 @@ See the file 'LICENCE' for copying permission
 
 import os
 import sys
+from lib import metrics
 from lib.common import (
     banner,
     checkdepends,
     initAgents,
-    initDirs,
+    mkdir_p,
+    parseArgs,
     setPaths,
     usage,
 )
 from lib.controler import start
-from lib.data import paths
+from lib.data import (
+    conf,
+    logger,
+    paths,
+)
+from lib.probe import probe
 
 
 def main():
@@ -28,17 +35,35 @@ def main():
 def init():
     try:
         paths.GITHACK_ROOT_PATH = os.path.dirname(os.path.realpath(__file__))
-        banner()
         if len(sys.argv) < 2:
+            banner()
             usage()
             sys.exit(1)
+        urls = parseArgs(sys.argv[1:])
+        if conf.PROBE and conf.OUTPUT == "-":
+            # stdout carries the JSON report alone
+            logger.stream = sys.stderr
+        banner()
+        if conf.METRICS_PORT:
+            metrics.serve(conf.METRICS_PORT)
+        if conf.PROBE:
+            setPaths()
+            initAgents()
+            mkdir_p(paths.GITHACK_DIST_ROOT_PATH)
+            output = conf.OUTPUT or os.path.join(
+                paths.GITHACK_DIST_ROOT_PATH, "probe.json"
+            )
+            probe(urls, output)
+            return
         checkdepends()
-        setPaths(sys.argv[-1])
+        setPaths()
         initAgents()
-        initDirs()
-        start()
+        start(urls)
     except Exception as e:
         raise e
+    finally:
+        if conf.get("METRICS"):
+            metrics.write_json(conf.METRICS)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+# Micro-benchmark of the commit decoding of the graph walk: the former path
+# (inflate for the walk, inflate again for the parser, two regexes over the
+# whole commit, a third one for the committer time) against decode_object +
+# parse_commit. Both are checked to agree before they are timed.
+#
+#     python bench/commit_parser.py [-n COMMITS] [-r REPEAT]
+
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.objects import (  # noqa: E402
+    decode_object,
+    parse_commit,
+)
+
+
+def legacy(raw):
+    """
+    The walk before the single-pass parser, kept as the reference
+    """
+    objdata = zlib.decompress(raw)
+    header, _, data = objdata.partition(b"\x00")
+    data = zlib.decompress(raw).partition(b"\x00")[2]
+    m = re.search(rb"\Atree ([a-z0-9]{40})\n", data, re.M | re.S | re.I)
+    tree = m.group(1) if m else None
+    parents = re.findall(b"parent ([a-z0-9]{40})\n", data, re.M | re.S | re.I)
+    m = re.search(rb"^committer .* (\d+) [+-]\d{4}$", data, re.M)
+    return (header.split(b" ")[0], tree, parents, int(m.group(1)) if m else 0)
+
+
+def single_pass(raw):
+    (objtype, data) = decode_object(raw)
+    commit = parse_commit(data)
+    return (objtype, commit.tree, commit.parents, commit.commit_time)
+
+
+def synthetic_commits(count, seed=0):
+    """
+    Compressed commits shaped like real ones: one or two parents, some
+    signed, messages from one line to a few KB
+    """
+    rand = random.Random(seed)
+
+    def sha():
+        return b"%040x" % rand.getrandbits(160)
+
+    retVal = []
+    for n in range(count):
+        when = 1500000000 + n * 60
+        lines = [b"tree " + sha()]
+        lines += [b"parent " + sha() for _ in range(2 if n % 10 == 0 else 1)]
+        ident = b"Dev %d <dev%d@example.com> %d +0800" % (n, n, when)
+        lines.append(b"author " + ident)
+        lines.append(b"committer " + ident)
+        if n % 4 == 0:
+            lines.append(b"gpgsig -----BEGIN PGP SIGNATURE-----")
+            lines += [b" " + os.urandom(48).hex().encode() for _ in range(12)]
+            lines.append(b" -----END PGP SIGNATURE-----")
+        words = [b"fix", b"update", b"refactor", b"config", b"parser", b"cache"]
+        length = rand.choice((4, 40, 400))
+        message = b" ".join(rand.choice(words) for _ in range(length))
+        data = b"\n".join(lines) + b"\n\n" + message + b"\n"
+        retVal.append(zlib.compress(b"commit %d\x00" % len(data) + data))
+    return retVal
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--commits", type=int, default=20000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+    commits = synthetic_commits(args.commits)
+    for raw in commits:
+        assert legacy(raw) == single_pass(raw)
+    results = {}
+    for name, func in (("legacy", legacy), ("single-pass", single_pass)):
+        best = min(
+            timeit.repeat(
+                lambda: [func(raw) for raw in commits], number=1, repeat=args.repeat
+            )
+        )
+        results[name] = best
+        rate = len(commits) / best
+        print("%-12s %8.1f ms  %10.0f commits/s" % (name, best * 1000, rate))
+    print("speedup      %8.2fx" % (results["legacy"] / results["single-pass"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+# Local threaded HTTP/1.1 server of a folder holding a .git, with keep-alive
+# and Range requests, which misbehaves on demand: latency on every
+# response, directory listing on or off, a share of loose objects answered
+# 404, and a request rate above which it answers 429 with Retry-After. It
+# counts what it serves so the benchmark does not rely on the client.
+#
+#     python bench/fakeserver.py DIR [--port N] [--latency S] [--no-listing]
+#                                    [--missing F] [--rate N]
+
+import argparse
+import collections
+import functools
+import hashlib
+import http.server
+import io
+import os
+import re
+import threading
+import time
+
+RANGE_RE = re.compile(r"\Abytes=(\d*)-(\d*)\Z")
+LOOSE_RE = re.compile(r"/objects/[0-9a-f]{2}/[0-9a-f]{38}\Z")
+
+
+class Handler(http.server.SimpleHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, with Nagle the body of a
+    # keep-alive response waits for the delayed ACK of the headers
+    disable_nagle_algorithm = True
+
+    def __init__(self, *args, server_state, **kwargs):
+        self.state = server_state
+        super().__init__(*args, **kwargs)
+
+    def send_head(self):
+        state = self.state
+        state.count_request()
+        if not state.admit():
+            self.send_response(429)
+            self.send_header("Retry-After", "1")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        if state.latency:
+            time.sleep(state.latency)
+        path = self.path.split("?", 1)[0]
+        if state.lost(path):
+            self.send_error(404)
+            return None
+        filename = self.translate_path(self.path)
+        match = RANGE_RE.match(self.headers.get("Range", ""))
+        if match and state.ranges and os.path.isfile(filename):
+            return self.send_range(filename, match)
+        return super().send_head()
+
+    def send_range(self, filename, match):
+        size = os.path.getsize(filename)
+        (first, last) = match.groups()
+        if first:
+            (first, last) = (int(first), min(int(last or size - 1), size - 1))
+        else:
+            # the last N bytes
+            (first, last) = (max(0, size - int(last or 0)), size - 1)
+        if first > last:
+            self.send_response(416)
+            self.send_header("Content-Range", "bytes */%d" % size)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        with open(filename, "rb") as f:
+            f.seek(first)
+            data = f.read(last - first + 1)
+        self.send_response(206)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Range", "bytes %d-%d/%d" % (first, last, size))
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        return io.BytesIO(data)
+
+    def list_directory(self, path):
+        if not self.state.listing:
+            self.send_error(403)
+            return None
+        return super().list_directory(path)
+
+    def copyfile(self, source, outputfile):
+        while True:
+            data = source.read(64 * 1024)
+            if not data:
+                break
+            outputfile.write(data)
+            self.state.count_bytes(len(data))
+
+    def log_request(self, code="-", size="-"):
+        self.state.count_status(code)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class State(object):
+    """
+    Settings and counters shared by the handler threads
+    """
+
+    def __init__(self, latency=0.0, listing=True, missing=0.0, rate=0, ranges=True):
+        self.latency = latency
+        self.listing = listing
+        self.missing = missing
+        self.rate = rate
+        self.ranges = ranges
+        self.lock = threading.Lock()
+        self.tokens = float(rate)
+        self.last = time.monotonic()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.statuses = collections.Counter()
+
+    def count_request(self):
+        with self.lock:
+            self.requests += 1
+
+    def count_status(self, code):
+        with self.lock:
+            self.statuses[int(code)] += 1
+
+    def count_bytes(self, size):
+        with self.lock:
+            self.bytes += size
+
+    def admit(self):
+        """
+        @desc:  Token bucket of rate requests per second, one second of burst
+        """
+        if not self.rate:
+            return True
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+            self.last = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+    def lost(self, path):
+        """
+        @desc:  Whether a loose object is one of the missing share, always
+                the same ones so that a retry does not find them
+        """
+        if not self.missing or not LOOSE_RE.search(path):
+            return False
+        digest = hashlib.md5(path.encode()).digest()
+        return int.from_bytes(digest[:4], "big") < self.missing * 0x100000000
+
+    def summary(self):
+        with self.lock:
+            return {
+                "requests": self.requests,
+                "bytes": self.bytes,
+                "statuses": {str(k): v for k, v in sorted(self.statuses.items())},
+            }
+
+
+class FakeServer(object):
+    """
+    Serve root on 127.0.0.1 from a background thread, url is the .git of
+    root
+    """
+
+    def __init__(self, root, port=0, **settings):
+        self.state = State(**settings)
+        handler = functools.partial(Handler, directory=root, server_state=self.state)
+        self.httpd = http.server.ThreadingHTTPServer(("127.0.0.1", port), handler)
+        self.httpd.daemon_threads = True
+        self.port = self.httpd.server_address[1]
+        self.url = "http://127.0.0.1:%d/.git/" % self.port
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self.url
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--no-listing", action="store_true")
+    parser.add_argument("--missing", type=float, default=0)
+    parser.add_argument("--rate", type=float, default=0)
+    parser.add_argument("--no-range", action="store_true")
+    args = parser.parse_args()
+    server = FakeServer(
+        args.root,
+        args.port,
+        latency=args.latency,
+        listing=not args.no_listing,
+        missing=args.missing,
+        rate=args.rate,
+        ranges=not args.no_range,
+    )
+    print("Serving %s" % server.url)
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+        print(server.state.summary())
+
+
+if __name__ == "__main__":
+    main()
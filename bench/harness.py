@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+# End-to-end benchmark of a dump: a synthetic repository (bench/synthrepo.py)
+# is served by the fake server (bench/fakeserver.py) and GitHack.py is run
+# against it once per method, each in its own process:
+#
+#     a   git clone, git in PATH
+#     b   directory listing, git hidden from PATH
+#     c   no listing, index and refs only, git hidden from PATH
+#
+# Reported per run: wall time, objects/s (objects of the repository over
+# the wall time), bytes/s and requests as seen by the server, peak RSS of
+# the process and of what it waited for, and whether HEAD was dumped.
+#
+#     python bench/harness.py [--methods abc] [--layout loose|pack|both]
+#                             [--commits N] [--fanout N] [--depth N]
+#                             [--blob-size N] [--latency S] [--missing F]
+#                             [--rate N] [--repeat N] [--json FILE]
+#                             [-- GitHack.py options]
+
+import argparse
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fakeserver import FakeServer  # noqa: E402
+from synthrepo import generate  # noqa: E402
+from lib.repo import list_refs  # noqa: E402
+
+GITHACK = os.path.join(ROOT, "GitHack.py")
+DIST = os.path.join(ROOT, "dist")
+
+METHODS = {
+    "a": "git clone",
+    "b": "listing",
+    "c": "no listing",
+}
+
+
+def without_git(path):
+    """
+    PATH minus the folders holding a git executable
+    """
+    return os.pathsep.join(
+        folder
+        for folder in path.split(os.pathsep)
+        if not os.access(os.path.join(folder, "git"), os.X_OK)
+    )
+
+
+def run(url, method, options, log):
+    """
+    Run GitHack.py on url in a child process, return (status, wall time,
+    peak RSS in KB)
+    """
+    env = dict(os.environ)
+    if method != "a":
+        env["PATH"] = without_git(env.get("PATH", ""))
+    # the interpreter by absolute path, a PATH without git may lack it
+    cmd = [sys.executable, GITHACK] + options + [url]
+    started = time.time()
+    with open(log, "ab") as f:
+        process = subprocess.Popen(
+            cmd, cwd=ROOT, env=env, stdin=subprocess.DEVNULL, stdout=f, stderr=f
+        )
+        (_, status, rusage) = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+    # ru_maxrss is in KB on Linux and in bytes on macOS
+    rss = rusage.ru_maxrss // (1024 if sys.platform == "darwin" else 1)
+    return (process.returncode, time.time() - started, rss)
+
+
+def dumped(folder, head):
+    """
+    Whether the dump of folder resolves HEAD to the generated head, and
+    the number of objects its report says are missing
+    """
+    gitdir = os.path.join(folder, ".git")
+    if not os.path.isdir(gitdir):
+        return (False, None)
+    missing = None
+    report = os.path.join(gitdir, "githack.json")
+    if os.path.exists(report):
+        with open(report) as f:
+            missing = len(json.load(f).get("missing", []))
+    return (list_refs(gitdir).get("HEAD") == head.encode(), missing)
+
+
+def bench(repo, root, method, args, log):
+    settings = dict(
+        latency=args.latency,
+        listing=method == "b",
+        missing=args.missing,
+        rate=args.rate,
+    )
+    with FakeServer(root, **settings) as server:
+        folder = os.path.join(DIST, "127.0.0.1_%d" % server.port)
+        try:
+            (code, wall, rss) = run(server.url, method, args.options, log)
+            (ok, missing) = dumped(folder, repo.head)
+        finally:
+            shutil.rmtree(folder, ignore_errors=True)
+            shutil.rmtree(folder + ".history", ignore_errors=True)
+        served = server.state.summary()
+    objects = sum(repo.objects.values())
+    return {
+        "method": method,
+        "exit": code,
+        "ok": ok,
+        "missing": missing,
+        "wall": round(wall, 3),
+        "objects": objects,
+        "objects_per_s": round(objects / wall, 1),
+        "bytes": served["bytes"],
+        "bytes_per_s": round(served["bytes"] / wall),
+        "requests": served["requests"],
+        "statuses": served["statuses"],
+        "peak_rss_kb": rss,
+    }
+
+
+def report(results):
+    print(
+        "%-6s %-7s %-3s %8s %8s %10s %12s %9s %10s  %s"
+        % (
+            "layout",
+            "method",
+            "ok",
+            "missing",
+            "wall(s)",
+            "objects/s",
+            "KB/s",
+            "requests",
+            "RSS(MB)",
+            "statuses",
+        )
+    )
+    for r in results:
+        statuses = " ".join("%s:%d" % item for item in r["statuses"].items())
+        print(
+            "%-6s %-7s %-3s %8s %8.2f %10.0f %12.1f %9d %10.1f  %s"
+            % (
+                r["layout"],
+                r["method"],
+                "yes" if r["ok"] else "no",
+                "-" if r["missing"] is None else r["missing"],
+                r["wall"],
+                r["objects_per_s"],
+                r["bytes_per_s"] / 1024,
+                r["requests"],
+                r["peak_rss_kb"] / 1024,
+                statuses,
+            )
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--methods", default="abc")
+    parser.add_argument("--layout", choices=("loose", "pack", "both"), default="both")
+    parser.add_argument("--commits", type=int, default=50)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--blob-size", type=int, default=4096)
+    parser.add_argument("--changes", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0)
+    parser.add_argument("--missing", type=float, default=0)
+    parser.add_argument("--rate", type=float, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--json")
+    parser.add_argument("--keep", action="store_true", help="keep the repositories")
+    parser.add_argument("options", nargs=argparse.REMAINDER)
+    args = parser.parse_args()
+    if args.options[:1] == ["--"]:
+        args.options = args.options[1:]
+    methods = [m for m in args.methods if m in METHODS]
+    if "a" in methods and not shutil.which("git"):
+        print("git is not in PATH, skip method a")
+        methods.remove("a")
+    layouts = ("loose", "pack") if args.layout == "both" else (args.layout,)
+    workdir = tempfile.mkdtemp(prefix="githack_bench_")
+    log = os.path.join(workdir, "githack.log")
+    results = []
+    try:
+        for layout in layouts:
+            root = os.path.join(workdir, layout)
+            repo = generate(
+                root,
+                args.commits,
+                args.fanout,
+                args.depth,
+                args.blob_size,
+                args.changes,
+                layout,
+            )
+            print(
+                "%s: %d objects, %d files, %d bytes, HEAD %s"
+                % (
+                    layout,
+                    sum(repo.objects.values()),
+                    repo.files,
+                    repo.bytes,
+                    repo.head,
+                )
+            )
+            for method in methods:
+                runs = [
+                    bench(repo, root, method, args, log) for _ in range(args.repeat)
+                ]
+                # the fastest run, the others are mostly noise
+                result = min(runs, key=lambda r: r["wall"])
+                result["layout"] = layout
+                results.append(result)
+    finally:
+        if args.keep:
+            print("Repositories and log kept in %s" % workdir)
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+    report(results)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+    return 0 if all(r["ok"] for r in results) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,274 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+# Generator of synthetic repositories for the end-to-end benchmark: a
+# linear history over a directory tree of fixed fan-out, written in-process
+# (no git needed) as loose objects or as a single pack, with the refs,
+# logs, index and the info files a dumb HTTP "git clone" reads.
+#
+#     python bench/synthrepo.py DIR [--commits N] [--fanout N] [--depth N]
+#                                   [--blob-size N] [--layout loose|pack]
+
+import argparse
+import binascii
+import collections
+import hashlib
+import os
+import random
+import struct
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.graph import (  # noqa: E402
+    BLOB,
+    COMMIT,
+    TREE,
+)
+from lib.objects import (  # noqa: E402
+    MODE_FILE,
+    MODE_TREE,
+)
+from lib.pack import PackWriter  # noqa: E402
+
+IDENT = b"Bench <bench@example.com>"
+EPOCH = 1600000000
+
+Repository = collections.namedtuple(
+    "Repository", ("gitdir", "head", "objects", "files", "bytes")
+)
+
+
+class Generator(object):
+    """
+    Objects of a repository whose tree has fanout files and, down to depth,
+    fanout subdirectories per directory; each commit rewrites changes files
+    picked at random. Blobs are hex text of blob_size bytes on average,
+    about as compressible as source code.
+    """
+
+    def __init__(self, fanout=8, depth=2, blob_size=4096, changes=4, seed=0):
+        self.fanout = fanout
+        self.depth = depth
+        self.blob_size = blob_size
+        self.changes = changes
+        self.rand = random.Random(seed)
+        self.objects = {}
+        self.root = {}
+        self.paths = []
+        self.populate(self.root, (), 0)
+
+    def store(self, objtype, data):
+        sha = hashlib.sha1(b"%s %d\x00" % (objtype, len(data)) + data).digest()
+        self.objects[sha] = (objtype, data)
+        return sha
+
+    def blob(self):
+        size = self.rand.randint(self.blob_size // 2, self.blob_size * 3 // 2)
+        if not size:
+            return self.store(BLOB, b"")
+        data = b"%x" % self.rand.getrandbits(size * 4)
+        return self.store(BLOB, data[:size].rjust(size, b"0"))
+
+    def populate(self, folder, prefix, level):
+        for n in range(self.fanout):
+            name = b"file_%03d.txt" % n
+            folder[name] = self.blob()
+            self.paths.append(prefix + (name,))
+            if level < self.depth:
+                name = b"dir_%03d" % n
+                folder[name] = {}
+                self.populate(folder[name], prefix + (name,), level + 1)
+
+    def tree(self, folder):
+        entries = []
+        for name, value in folder.items():
+            if isinstance(value, dict):
+                # git sorts a directory as if its name ended with "/"
+                entries.append((name + b"/", MODE_TREE, name, self.tree(value)))
+            else:
+                entries.append((name, MODE_FILE, name, value))
+        entries.sort()
+        data = b"".join(m + b" " + name + b"\x00" + sha for _, m, name, sha in entries)
+        return self.store(TREE, data)
+
+    def commit(self, n, parent):
+        changes = min(self.changes, len(self.paths)) if parent else 0
+        for path in self.rand.sample(self.paths, changes):
+            folder = self.root
+            for name in path[:-1]:
+                folder = folder[name]
+            folder[path[-1]] = self.blob()
+        lines = [b"tree " + binascii.hexlify(self.tree(self.root))]
+        if parent:
+            lines.append(b"parent " + binascii.hexlify(parent))
+        ident = b"%s %d +0000" % (IDENT, EPOCH + n * 60)
+        lines.append(b"author " + ident)
+        lines.append(b"committer " + ident)
+        data = b"\n".join(lines) + b"\n\ncommit %d\n" % n
+        return self.store(COMMIT, data)
+
+    def files(self):
+        """
+        [(path, sha)] of the files of the last commit, sorted like the index
+        """
+        retVal = []
+
+        def walk(folder, prefix):
+            for name, value in folder.items():
+                if isinstance(value, dict):
+                    walk(value, prefix + name + b"/")
+                else:
+                    retVal.append((prefix + name, value))
+
+        walk(self.root, b"")
+        return sorted(retVal)
+
+
+def generate(
+    root,
+    commits=50,
+    fanout=8,
+    depth=2,
+    blob_size=4096,
+    changes=4,
+    layout="loose",
+    seed=0,
+):
+    """
+    Write a repository to root/.git, return a Repository (gitdir, head
+    hex sha, {type: count} of the objects, files at HEAD, bytes of
+    .git/objects)
+    """
+    generator = Generator(fanout, depth, blob_size, changes, seed)
+    head = None
+    log = []
+    for n in range(max(1, commits)):
+        parent = head
+        head = generator.commit(n, parent)
+        log.append((parent, head, n))
+    gitdir = os.path.join(root, ".git")
+    objdir = os.path.join(gitdir, "objects")
+    os.makedirs(os.path.join(objdir, "info"), exist_ok=True)
+    os.makedirs(os.path.join(objdir, "pack"), exist_ok=True)
+    packs = b""
+    if layout == "pack":
+        packs = write_pack(objdir, generator.objects)
+    else:
+        write_loose(objdir, generator.objects)
+    hexhead = binascii.hexlify(head)
+    files = generator.files()
+    write(gitdir, "HEAD", b"ref: refs/heads/master\n")
+    write(gitdir, "refs/heads/master", hexhead + b"\n")
+    write(gitdir, "info/refs", hexhead + b"\trefs/heads/master\n")
+    write(gitdir, "objects/info/packs", packs + b"\n")
+    write(gitdir, "config", b"[core]\n\trepositoryformatversion = 0\n\tbare = false\n")
+    write(gitdir, "description", b"Synthetic benchmark repository\n")
+    write(gitdir, "COMMIT_EDITMSG", b"commit %d\n" % (len(log) - 1))
+    write(gitdir, "logs/HEAD", reflog(log))
+    write(gitdir, "logs/refs/heads/master", reflog(log))
+    write(gitdir, "index", index(files, generator.objects))
+    counts = collections.Counter(t.decode() for t, _ in generator.objects.values())
+    size = 0
+    for folder, _, names in os.walk(objdir):
+        size += sum(os.path.getsize(os.path.join(folder, name)) for name in names)
+    return Repository(gitdir, hexhead.decode(), dict(counts), len(files), size)
+
+
+def write(gitdir, relpath, data):
+    filename = os.path.join(gitdir, relpath)
+    os.makedirs(os.path.dirname(filename), exist_ok=True)
+    with open(filename, "wb") as f:
+        f.write(data)
+
+
+def write_loose(objdir, objects):
+    for sha, (objtype, data) in objects.items():
+        hexsha = binascii.hexlify(sha).decode()
+        folder = os.path.join(objdir, hexsha[:2])
+        os.makedirs(folder, exist_ok=True)
+        with open(os.path.join(folder, hexsha[2:]), "wb") as f:
+            f.write(zlib.compress(b"%s %d\x00" % (objtype, len(data)) + data))
+
+
+def write_pack(objdir, objects):
+    """
+    Write every object into one pack, return its objects/info/packs line
+    """
+    tmpfile = os.path.join(objdir, "pack", "tmp_pack_bench.pack")
+    writer = PackWriter(tmpfile, len(objects))
+    for sha, (objtype, data) in objects.items():
+        writer.add(sha, objtype, data)
+    name = "pack-" + binascii.hexlify(writer.close()).decode()
+    for ext in (".pack", ".idx"):
+        os.replace(tmpfile[:-5] + ext, os.path.join(objdir, "pack", name + ext))
+    return b"P %s.pack\n" % name.encode()
+
+
+def reflog(log):
+    lines = []
+    for parent, sha, n in log:
+        old = binascii.hexlify(parent) if parent else b"0" * 40
+        lines.append(
+            b"%s %s %s %d +0000\tcommit: commit %d\n"
+            % (old, binascii.hexlify(sha), IDENT, EPOCH + n * 60, n)
+        )
+    return b"".join(lines)
+
+
+def index(files, objects):
+    """
+    Version 2 index of [(path, sha)], stat data left zeroed
+    """
+    data = b"DIRC" + struct.pack("!II", 2, len(files))
+    for path, sha in files:
+        size = len(objects[sha][1])
+        fields = (0, 0, 0, 0, 0, 0, 0o100644, 0, 0, size)
+        entry = struct.pack("!10I20sH", *fields, sha, min(len(path), 0xFFF)) + path
+        # NUL-terminated, padded to a multiple of 8 bytes
+        data += entry + b"\x00" * (8 - len(entry) % 8)
+    return data + hashlib.sha1(data).digest()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root")
+    parser.add_argument("--commits", type=int, default=50)
+    parser.add_argument("--fanout", type=int, default=8)
+    parser.add_argument("--depth", type=int, default=2)
+    parser.add_argument("--blob-size", type=int, default=4096)
+    parser.add_argument("--changes", type=int, default=4)
+    parser.add_argument("--layout", choices=("loose", "pack"), default="loose")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    repo = generate(
+        args.root,
+        args.commits,
+        args.fanout,
+        args.depth,
+        args.blob_size,
+        args.changes,
+        args.layout,
+        args.seed,
+    )
+    print("%s HEAD %s" % (repo.gitdir, repo.head))
+    print(
+        "%d objects (%s), %d files, %d bytes"
+        % (
+            sum(repo.objects.values()),
+            ", ".join("%d %ss" % (n, t) for t, n in sorted(repo.objects.items())),
+            repo.files,
+            repo.bytes,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+# Micro-benchmark of the tree decoding of the graph walk on a large
+# generated directory: the former path (a Python step per entry, int() of
+# the mode, hexlify of every sha for the walk and unhexlify again for the
+# graph) against parse_tree, whose records keep the raw 20-byte shas.
+#
+#     python bench/tree_parser.py [-n ENTRIES] [-r REPEAT]
+
+import argparse
+import binascii
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lib.objects import (  # noqa: E402
+    MODE_GITLINK,
+    MODE_TREE,
+    parse_tree,
+)
+
+
+def legacy(text):
+    """
+    The walk before the regex tree parser, kept as the reference
+    """
+    count = 0
+    entries = []
+    l = len(text)
+    while count < l:
+        mode_end = text.index(b" ", count)
+        mode = int(text[count:mode_end], 8)
+        name_end = text.index(b"\0", mode_end)
+        name = text[mode_end + 1 : name_end]
+        count = name_end + 21
+        sha = text[name_end + 1 : count]
+        assert len(sha) == 20
+        entries.append((mode, name, sha))
+    refs = []
+    for (mode, name, sha) in entries:
+        if mode == 0o160000:
+            continue
+        hexsha = binascii.hexlify(sha)
+        assert len(hexsha) == 40
+        refs.append((hexsha, b"tree" if mode == 0o40000 else b"blob", name))
+    return [(binascii.unhexlify(h), t, n) for (h, t, n) in refs]
+
+
+def single_pass(text):
+    return [
+        (sha, b"tree" if mode == MODE_TREE else b"blob", name)
+        for (mode, name, sha) in parse_tree(text)
+        if mode != MODE_GITLINK
+    ]
+
+
+def synthetic_tree(count, seed=0):
+    """
+    A flat generated directory: mostly files, some subdirectories, a few
+    executables, symlinks and submodules, sorted like git sorts them
+    """
+    rand = random.Random(seed)
+    modes = [b"100644"] * 80 + [b"40000"] * 12 + [b"100755"] * 5
+    modes += [b"120000"] * 2 + [b"160000"]
+    entries = []
+    for n in range(count):
+        name = b"module_%06d.generated.%s" % (n, rand.choice((b"js", b"php", b"py")))
+        sha = rand.getrandbits(160).to_bytes(20, "big")
+        entries.append((name, rand.choice(modes), sha))
+    entries.sort()
+    return b"".join(mode + b" " + name + b"\0" + sha for (name, mode, sha) in entries)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", "--entries", type=int, default=50000)
+    parser.add_argument("-r", "--repeat", type=int, default=5)
+    args = parser.parse_args()
+    tree = synthetic_tree(args.entries)
+    assert legacy(tree) == single_pass(tree)
+    results = {}
+    for name, func in (("legacy", legacy), ("single-pass", single_pass)):
+        best = min(timeit.repeat(lambda: func(tree), number=1, repeat=args.repeat))
+        results[name] = best
+        rate = args.entries / best
+        print("%-12s %8.1f ms  %10.0f entries/s" % (name, best * 1000, rate))
+    print("speedup      %8.2fx" % (results["legacy"] / results["single-pass"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -7,32 +7,56 @@ Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
 See the file 'LICENCE' for copying permission
 """
 
+import argparse
+import contextvars
 import os
-import subprocess
+import shutil
 import sys
 import urllib.parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
 from lib.data import (
     agents,
+    conf,
     logger,
     paths,
     target,
 )
+from lib.schedule import (
+    Budget,
+    split_patterns,
+)
 from lib.settings import (
     BANNER,
+    CHUNK_SIZE,
     DEPENDS,
+    JOBS,
+    MAX_REQUESTS,
+    PRIORITY_PATHS,
+    PROBE_JOBS,
+    THREADS,
     USAGE,
 )
 
 
+class ThreadPool(ThreadPoolExecutor):
+    """
+    ThreadPoolExecutor whose tasks run in a copy of the submitter's context,
+    so workers see the target they were started for
+    """
+
+    def submit(self, fn, /, *args, **kwargs):
+        return super().submit(contextvars.copy_context().run, fn, *args, **kwargs)
+
+
 def checkdepends():
+    """
+    git is optional, it is only used to try a plain clone first
+    """
     logger.info("Check Depends")
-    process = subprocess.Popen(
-        "git --version", shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE
-    )
-    stdout, stderr = process.communicate()
-    if stderr:
-        logger.error(DEPENDS)
-        sys.exit(1)
+    conf.GIT = shutil.which("git")
+    if conf.GIT is None:
+        logger.warning(DEPENDS)
+        return
     logger.success("Check depends end")
 
 
@@ -50,27 +74,99 @@ def banner():
     logger.p(BANNER, logger.GREEN)
 
 
-def setPaths(url):
+def parseArgs(argv):
+    parser = argparse.ArgumentParser(usage=argparse.SUPPRESS, add_help=False)
+    parser.add_argument("-t", "--threads", type=int, default=THREADS)
+    parser.add_argument("-r", "--range", action="store_true")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE)
+    parser.add_argument("--rate", type=float, default=0)
+    parser.add_argument("-l", "--list")
+    parser.add_argument("-j", "--jobs", type=int)
+    parser.add_argument("--max-requests", type=int, default=MAX_REQUESTS)
+    parser.add_argument("--priority", default=PRIORITY_PATHS)
+    parser.add_argument("--only")
+    parser.add_argument("--max-time", type=float, default=0)
+    parser.add_argument("--max-bytes", type=int, default=0)
+    parser.add_argument("--export", choices=("tree", "fast-import"))
+    parser.add_argument("--repack", action="store_true")
+    parser.add_argument("--repack-deltas", action="store_true")
+    parser.add_argument("--metrics")
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("--probe", action="store_true")
+    parser.add_argument("-o", "--output")
+    parser.add_argument("url", nargs="?")
+    try:
+        args = parser.parse_args(argv)
+        if not args.url and not args.list:
+            parser.error("url or --list is required")
+    except SystemExit:
+        usage()
+        sys.exit(1)
+    conf.THREADS = max(1, args.threads)
+    conf.RANGE = args.range
+    conf.CHUNK_SIZE = max(1024, args.chunk_size)
+    conf.RATE = max(0, args.rate)
+    conf.JOBS = max(1, args.jobs or (PROBE_JOBS if args.probe else JOBS))
+    conf.MAX_REQUESTS = max(1, args.max_requests)
+    conf.PRIORITY = split_patterns(args.priority)
+    conf.ONLY = split_patterns(args.only)
+    conf.MAX_TIME = max(0, args.max_time)
+    conf.MAX_BYTES = max(0, args.max_bytes)
+    conf.EXPORT = args.export
+    conf.REPACK = args.repack or args.repack_deltas
+    conf.REPACK_DELTAS = args.repack_deltas
+    conf.METRICS = args.metrics
+    conf.METRICS_PORT = args.metrics_port
+    conf.PROBE = args.probe
+    conf.OUTPUT = args.output
+    urls = [args.url] if args.url else []
+    if args.list:
+        urls.extend(readTargets(args.list))
+    # keep the order, drop duplicates
+    return list(dict.fromkeys(urls))
+
+
+def readTargets(filename):
+    """
+    One url per line, blank lines and # comments are skipped; - is stdin
+    """
+    if filename == "-":
+        lines = sys.stdin.read().splitlines()
+    else:
+        lines = readFile(filename).decode("utf-8", "replace").splitlines()
+    return [line.strip() for line in lines if line.strip()[:1] not in ("", "#")]
+
+
+def setPaths():
     logger.info("Set Paths")
+    paths.GITHACK_DIST_ROOT_PATH = os.path.join(paths.GITHACK_ROOT_PATH, "dist")
+    paths.GITHACK_DATA_PATH = os.path.join(paths.GITHACK_ROOT_PATH, "data")
+    paths.USER_AGENTS = os.path.join(paths.GITHACK_DATA_PATH, "user-agents.txt")
+
+
+def setTarget(url):
+    """
+    Bind a fresh target to the current context and set its url and paths
+    """
+    target.bind()
     target.TARGET_GIT_URL = url if (url[-1] == "/") else url + "/"
     target.TARGET_DIST = urlparse.urlparse(target.TARGET_GIT_URL).netloc.replace(
         ":", "_"
     )
     logger.info("Target Url: %s" % (target.TARGET_GIT_URL))
-    paths.GITHACK_DIST_ROOT_PATH = os.path.join(paths.GITHACK_ROOT_PATH, "dist")
-    paths.GITHACK_DATA_PATH = os.path.join(paths.GITHACK_ROOT_PATH, "data")
-    paths.USER_AGENTS = os.path.join(paths.GITHACK_DATA_PATH, "user-agents.txt")
-    paths.GITHACK_DIST_TARGET_PATH = os.path.join(
-        paths.GITHACK_DIST_ROOT_PATH, target.TARGET_DIST
-    )
-    paths.GITHACK_DIST_TARGET_GIT_PATH = os.path.join(
-        paths.GITHACK_DIST_TARGET_PATH, ".git"
+    target.TARGET_PATH = os.path.join(paths.GITHACK_DIST_ROOT_PATH, target.TARGET_DIST)
+    target.TARGET_GIT_PATH = os.path.join(target.TARGET_PATH, ".git")
+    target.TARGET_JOURNAL = os.path.join(target.TARGET_GIT_PATH, "githack.db")
+    target.TARGET_REPORT = os.path.join(target.TARGET_GIT_PATH, "githack.json")
+    target.TARGET_HISTORY = os.path.join(
+        paths.GITHACK_DIST_ROOT_PATH, target.TARGET_DIST + ".history"
     )
+    target.BUDGET = Budget(conf.MAX_TIME, conf.MAX_BYTES)
 
 
 def mkdir_p(path):
     if not os.path.exists(path):
-        os.makedirs(path)
+        os.makedirs(path, exist_ok=True)
         # logger.info("Create Directory: %s" % (path))
     # else:
     # logger.info("Directory Exists: %s " % (path))
@@ -78,8 +174,7 @@ def mkdir_p(path):
 
 def initDirs():
     logger.info("Initialize Target")
-    mkdir_p(paths.GITHACK_DIST_ROOT_PATH)
-    mkdir_p(paths.GITHACK_DIST_TARGET_PATH)
+    mkdir_p(target.TARGET_PATH)
 
 
 def initAgents():
@@ -8,42 +8,137 @@ See the file 'LICENCE' for copying permission
 """
 
 import os
-from lib.data import paths
+import time
+from lib import (
+    metrics,
+    throttle,
+)
+from lib.common import (
+    ThreadPool,
+    initDirs,
+    setTarget,
+)
+from lib.data import conf
 from lib.data import logger
+from lib.data import target
+from lib.export import export_history
 from lib.git import (
     clone,
     clone_from_list,
     clone_from_cache,
+    close_store,
     init,
     refresh_files,
     valid_git_repo,
 )
-from lib.request import isdirlist
+from lib.journal import (
+    close_journal,
+    open_journal,
+)
+from lib.repack import repack
+from lib.request import (
+    isdirlist,
+    negative,
+    pool,
+)
+
+
+def start(urls):
+    if len(urls) == 1:
+        setTarget(urls[0])
+        initDirs()
+        dump()
+    else:
+        start_batch(urls)
+    logger.info(pool.summary())
+    logger.info(negative.summary())
+    logger.info(throttle.summary())
+    logger.info(metrics.summary())
+    pool.close()
 
 
-def start():
-    if method_a() or method_b() or method_c():
+def start_batch(urls):
+    """
+    Dump every url, conf.JOBS targets at a time. Each one runs in its own
+    context (url, paths, journal, packs) and shares the connection pool,
+    the negative cache and the request limits with the others.
+    """
+    logger.info(f"Batch of {len(urls)} targets, {conf.JOBS} at a time")
+    started = time.time()
+    with ThreadPool(max_workers=conf.JOBS) as executor:
+        results = list(executor.map(dump_target, urls))
+    logger.p("", logger.GREEN)
+    for url, result in zip(urls, results):
+        if result:
+            logger.success(f"{url} -> {result}")
+        else:
+            logger.error(f"{url} failed")
+    logger.info(
+        "Batch done: %d/%d targets dumped in %.1fs"
+        % (len([r for r in results if r]), len(urls), time.time() - started)
+    )
+
+
+def dump_target(url):
+    """
+    Dump one target of a batch, return its folder or None on failure
+    """
+    setTarget(url)
+    target.LOG_PREFIX = f"[{target.TARGET_DIST}] "
+    try:
+        initDirs()
+        if dump():
+            return target.TARGET_PATH
+    except (Exception, SystemExit) as e:
+        # one target going wrong, even by exiting, must not end the batch
+        logger.error(f"Exception occurred: {e!r}")
+        close_store()
+        close_journal()
+    return None
+
+
+def dump():
+    ok = method_a() or method_b() or method_c()
+    # everything downloaded is on disk before the dump is reused
+    close_store()
+    if ok and conf.EXPORT:
+        export_history(conf.EXPORT)
+    if ok and conf.REPACK:
+        repack(conf.REPACK_DELTAS)
+    if ok:
         job_success()
     else:
         job_fail()
+    close_journal()
+    return ok
 
 
+@metrics.timed("method_a")
 def method_a():
     logger.info("Try to Clone straightly")
-    git_dir = os.path.join(paths.GITHACK_DIST_TARGET_PATH, ".git")
+    git_dir = os.path.join(target.TARGET_PATH, ".git")
     if os.path.exists(git_dir):
         logger.warning(f"[Skip][First Try] {git_dir} already exists.")
-        return valid_git_repo()
+        if valid_git_repo() and not target.GRAPH.missing:
+            return True
+        # a partial dump (budget, interruption) resumes from its journal
+        logger.info("Repository is incomplete, resume the dump")
+        return False
+    if not conf.get("GIT"):
+        logger.warning("[Skip][First Try] git is not available")
+        return False
     return clone()
 
 
+@metrics.timed("method_b")
 def method_b():
     logger.info("Try to Clone with Directory Listing")
     if isdirlist():
         try:
-            git_dir = os.path.join(paths.GITHACK_DIST_TARGET_PATH, ".git")
+            git_dir = os.path.join(target.TARGET_PATH, ".git")
             if not os.path.exists(git_dir):
                 init()
+            open_journal()
             clone_from_list("/")
             refresh_files()
             if not valid_git_repo():
@@ -58,11 +153,13 @@ def method_b():
     return False
 
 
+@metrics.timed("method_c")
 def method_c():
     logger.info("Try to clone with Cache")
-    git_dir = os.path.join(paths.GITHACK_DIST_TARGET_PATH, ".git")
+    git_dir = os.path.join(target.TARGET_PATH, ".git")
     if not os.path.exists(git_dir):
         init()
+    open_journal()
     clone_from_cache()
     if not valid_git_repo():
         logger.warning("Clone With Cache end. But missed some files.")
@@ -71,7 +168,7 @@ def method_c():
 
 def job_success():
     logger.p("", logger.GREEN)
-    logger.success(f"Clone Success. Dist File : {paths.GITHACK_DIST_TARGET_PATH}")
+    logger.success(f"Clone Success. Dist File : {target.TARGET_PATH}")
 
 
 def job_fail():
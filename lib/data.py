@@ -7,16 +7,56 @@ Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
 See the file 'LICENCE' for copying permission
 """
 
+import contextvars
 from lib.attrdict import AttribDict
 from lib.log import LOGGER
 
 # logger
 logger = LOGGER()
 
-# paths
+# paths shared by every target
 paths = AttribDict()
 
-target = AttribDict()
+# options
+conf = AttribDict()
+
+
+class TargetProxy(object):
+    """
+    The target being dumped. Attribute access is forwarded to the AttribDict
+    bound to the current context, so that concurrent dumps (batch mode)
+    each see their own url, paths, journal and packs
+    """
+
+    def __init__(self):
+        object.__setattr__(self, "_current", contextvars.ContextVar("target"))
+
+    def bind(self, context=None):
+        context = AttribDict() if context is None else context
+        self._current.set(context)
+        return context
+
+    def _context(self):
+        try:
+            return self._current.get()
+        except LookupError:
+            raise AttributeError("no target bound to the current context")
+
+    def __getattr__(self, item):
+        return getattr(self._context(), item)
+
+    def __setattr__(self, item, value):
+        setattr(self._context(), item, value)
+
+    def get(self, item, default=None):
+        context = self._current.get(None)
+        return default if context is None else context.get(item, default)
+
+
+# per-target state
+target = TargetProxy()
+
+logger.prefix = lambda: target.get("LOG_PREFIX", "")
 
 agents = []
 
@@ -0,0 +1,480 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import binascii
+import os
+import re
+import shutil
+import time
+from lib.common import (
+    ThreadPool,
+    mkdir_p,
+    writeFile,
+)
+from lib.data import (
+    conf,
+    logger,
+    target,
+)
+from lib.git import (
+    close_packs,
+    close_store,
+    load_packs,
+    local_object,
+    safe_path,
+)
+from lib.graph import (
+    COMMIT,
+    TAG,
+    TREE,
+)
+from lib.objects import (
+    MODE_EXECUTABLE,
+    MODE_GITLINK,
+    MODE_TREE,
+    ident_time,
+    parse_commit,
+    parse_tree,
+)
+from lib.repo import (
+    list_refs,
+    symbolic_ref,
+)
+
+
+def export_history(mode):
+    """
+    Rebuild every recovered commit from the objects on disk, nothing is
+    fetched: "tree" writes the tree of each commit to a folder, "fast-import"
+    writes a stream for "git fast-import"
+    """
+    started = time.time()
+    load_packs(remote=False)
+    try:
+        history = History(
+            list_refs(target.TARGET_GIT_PATH), symbolic_ref(target.TARGET_GIT_PATH)
+        )
+        if not history.commits:
+            logger.warning("Export History: no commit on disk")
+            return False
+        if mode == "fast-import":
+            output = target.TARGET_HISTORY + ".fi"
+            with open(output, "wb") as f:
+                count = history.fast_import(f)
+        else:
+            output = target.TARGET_HISTORY
+            count = history.materialize(output)
+    finally:
+        close_packs()
+        close_store()
+    logger.success(
+        "Export %d commits, %d trees, %d blobs to %s in %.2fs"
+        % (
+            len(history.commits),
+            len(history.trees),
+            count,
+            output,
+            time.time() - started,
+        )
+    )
+    if history.missing:
+        logger.warning(f"Export History: {len(history.missing)} objects missing")
+    return True
+
+
+# the headers a fast-import commit command carries over
+COMMIT_HEADERS = {b"tree", b"parent", b"author", b"committer"}
+
+
+def parse_commit_headers(data):
+    """
+    Return ({header: [values]}, message) of a commit, continuation lines
+    (signatures) are folded into their header
+    """
+    (head, _, message) = data.partition(b"\n\n")
+    headers = {}
+    last = None
+    for line in head.split(b"\n"):
+        if line.startswith(b" ") and last is not None:
+            headers[last][-1] += b"\n" + line[1:]
+            continue
+        (last, _, value) = line.partition(b" ")
+        headers.setdefault(last, []).append(value)
+    return headers, message
+
+
+def commit_date(ident):
+    """
+    UTC timestamp of an author/committer line, as 20240102-030405
+    """
+    return time.strftime("%Y%m%d-%H%M%S", time.gmtime(ident_time(ident or b"")))
+
+
+def quote_path(path):
+    """
+    Path of a fast-import filemodify/delete command, C-style quoted when
+    it would otherwise be ambiguous
+    """
+    if not (path.startswith(b'"') or re.search(rb'[\x00-\x1f"\\\\]', path)):
+        return path
+    escaped = re.sub(
+        rb'[\x00-\x1f"\\\\]',
+        lambda m: b"\\%03o" % m.group(0)[0]
+        if m.group(0) not in (b'"', b"\\")
+        else b"\\" + m.group(0),
+        path,
+    )
+    return b'"' + escaped + b'"'
+
+
+class History(object):
+    """
+    Commits reachable from the refs with the objects on disk, parents
+    before children. Trees are parsed once however many commits share
+    them.
+    """
+
+    def __init__(self, refs, head=None):
+        self.head = head
+        self.refs = {}
+        self.tags = {}
+        self.commits = []
+        self.trees = {}
+        self.missing = set()
+        self.parsed = {}
+        for name, sha in sorted(refs.items()):
+            raw = binascii.unhexlify(sha)
+            key = self._peel(raw)
+            if key is None:
+                continue
+            self.refs[name] = key
+            if raw != key:
+                # the annotated tag object the ref points to
+                self.tags[name] = local_object(raw)[1]
+        self._sort(list(self.refs.values()))
+
+    def _peel(self, key):
+        """
+        @desc:  Commit a ref points to, through annotated tags
+        """
+        for _ in range(10):
+            obj = local_object(key)
+            if obj is None:
+                self.missing.add(key)
+                return None
+            if obj[0] == COMMIT:
+                return key
+            if obj[0] != TAG:
+                return None
+            m = re.match(rb"object ([0-9a-f]{40})\n", obj[1])
+            if not m:
+                return None
+            key = binascii.unhexlify(m.group(1))
+        return None
+
+    def _commit(self, key):
+        """
+        @desc:  (tree, parents, headers, message) of a commit, None if missing
+        """
+        if key not in self.parsed:
+            obj = local_object(key)
+            if obj is None or obj[0] != COMMIT:
+                self.missing.add(key)
+                self.parsed[key] = None
+            else:
+                (tree, parents, _, _) = parse_commit(obj[1])
+                (headers, message) = parse_commit_headers(obj[1])
+                self.parsed[key] = (
+                    binascii.unhexlify(tree) if tree else None,
+                    [binascii.unhexlify(p) for p in parents],
+                    headers,
+                    message,
+                )
+        return self.parsed[key]
+
+    def _sort(self, roots):
+        """
+        @desc:  Topological order without recursion: a commit is appended
+                once all of its parents on disk have been
+        """
+        done = set()
+        for root in roots:
+            stack = [(root, False)]
+            while stack:
+                (key, expanded) = stack.pop()
+                if key in done:
+                    continue
+                commit = self._commit(key)
+                if commit is None:
+                    done.add(key)
+                    continue
+                if expanded:
+                    done.add(key)
+                    self.commits.append(key)
+                    continue
+                stack.append((key, True))
+                for parent in reversed(commit[1]):
+                    if parent not in done:
+                        stack.append((parent, False))
+
+    def tree(self, key):
+        """
+        @desc:  {name: (mode, sha)} of a tree, None if missing
+        """
+        if key not in self.trees:
+            obj = local_object(key)
+            if obj is None or obj[0] != TREE:
+                self.missing.add(key)
+                self.trees[key] = None
+            else:
+                self.trees[key] = {
+                    name: (mode, sha)
+                    for (mode, name, sha) in parse_tree(obj[1])
+                    if safe_path(name.decode("utf-8", "replace"))
+                }
+        return self.trees[key]
+
+    def materialize(self, output):
+        """
+        @desc:  Write the tree of every commit to output/<date>_<sha>. Each
+                blob is inflated once into output/.blobs and hard linked
+                everywhere it appears; a tree seen before is a symbolic link
+                to its first copy. Return the number of distinct blobs.
+        """
+        store = os.path.join(output, ".blobs")
+        mkdir_p(store)
+        blobs = set()
+        seen = set()
+        for key in self.commits:
+            self._blobs(self._commit(key)[0], blobs, seen)
+        with ThreadPool(max_workers=conf.THREADS) as executor:
+            list(executor.map(lambda blob: self._store(store, *blob), blobs))
+
+        copies = {}
+        log = []
+        for key in reversed(self.commits):
+            (tree, _, headers, message) = self._commit(key)
+            hexsha = binascii.hexlify(key).decode()
+            name = f"{commit_date(headers.get(b'committer', [b''])[0])}_{hexsha[:10]}"
+            folder = os.path.join(output, name)
+            if tree is None or self.tree(tree) is None:
+                # no folder for it, the log says so
+                name = "(tree missing)"
+            elif not os.path.lexists(folder):
+                self._tree(tree, folder, store, copies)
+            subject = message.split(b"\n", 1)[0].decode("utf-8", "replace")
+            log.append(f"{hexsha} {name} {subject}\n")
+        writeFile(os.path.join(output, "log.txt"), "".join(log).encode("utf-8"))
+        return len(blobs)
+
+    def _blobs(self, key, blobs, seen):
+        """
+        @desc:  Add the (sha, executable) of the blobs under tree key to
+                blobs, the trees in seen are not walked again
+        """
+        stack = [key] if key is not None else []
+        while stack:
+            key = stack.pop()
+            if key in seen:
+                continue
+            seen.add(key)
+            for (mode, sha) in (self.tree(key) or {}).values():
+                if mode == MODE_TREE:
+                    stack.append(sha)
+                elif mode != MODE_GITLINK:
+                    blobs.add((sha, mode == MODE_EXECUTABLE))
+
+    def _store(self, store, sha, executable):
+        """
+        @desc:  Inflate a blob into the store once
+        """
+        filename = os.path.join(store, binascii.hexlify(sha).decode())
+        if executable:
+            filename += ".x"
+        if os.path.exists(filename):
+            return filename
+        obj = local_object(sha)
+        if obj is None:
+            self.missing.add(sha)
+            return None
+        writeFile(filename, obj[1])
+        if executable:
+            os.chmod(filename, os.stat(filename).st_mode | 0o111)
+        return filename
+
+    def _tree(self, key, folder, store, copies):
+        stack = [(key, folder)]
+        while stack:
+            (key, folder) = stack.pop()
+            if key in copies:
+                try:
+                    os.symlink(
+                        os.path.relpath(copies[key], os.path.dirname(folder)), folder
+                    )
+                    continue
+                except OSError:
+                    # no symbolic links here (Windows), write the tree again
+                    pass
+            entries = self.tree(key)
+            if entries is None:
+                continue
+            mkdir_p(folder)
+            copies.setdefault(key, folder)
+            for name, (mode, sha) in entries.items():
+                path = os.path.join(folder, name.decode("utf-8", "replace"))
+                if mode == MODE_TREE:
+                    stack.append((sha, path))
+                elif mode != MODE_GITLINK:
+                    source = os.path.join(store, binascii.hexlify(sha).decode())
+                    if mode == MODE_EXECUTABLE:
+                        source += ".x"
+                    if os.path.exists(source) and not os.path.lexists(path):
+                        try:
+                            os.link(source, path)
+                        except OSError:
+                            shutil.copyfile(source, path)
+
+    def fast_import(self, f):
+        """
+        @desc:  Write a "git fast-import" stream of the history to f. Blobs
+                are sent once and referred to by mark; each commit only
+                lists the changes from its first parent, identical subtrees
+                are skipped. A commit whose tree is missing is left out,
+                and one which cannot come out identical (signature, mergetag,
+                encoding, missing parent or files) is written with a
+                warning. Return the number of blobs sent.
+        """
+        marks = {}
+        blobs = {}
+        # objects of the commit being written which are not on disk
+        lost = []
+        # commits whose id changes, theirs or through an ancestor
+        changed = set()
+
+        def blob(sha):
+            if sha not in blobs:
+                obj = local_object(sha)
+                if obj is None:
+                    self.missing.add(sha)
+                    blobs[sha] = None
+                    return None
+                blobs[sha] = len(marks) + len(blobs) + 1
+                f.write(b"blob\nmark :%d\ndata %d\n" % (blobs[sha], len(obj[1])))
+                f.write(obj[1] + b"\n")
+            return blobs[sha]
+
+        def changes(old, new, prefix):
+            """
+            @desc:  filemodify/filedelete lines turning tree old into new
+            """
+            old = (self.tree(old) or {}) if old is not None else {}
+            if new is not None and self.tree(new) is None:
+                lost.append(new)
+            new = (self.tree(new) or {}) if new is not None else {}
+            lines = []
+            for name in sorted(old.keys() - new.keys()):
+                lines.append(b"D " + quote_path(prefix + name))
+            for name, (mode, sha) in sorted(new.items()):
+                if old.get(name) == (mode, sha):
+                    continue
+                (oldmode, oldsha) = old.get(name, (None, None))
+                path = prefix + name
+                if mode == MODE_TREE:
+                    if oldmode is not None and oldmode != MODE_TREE:
+                        lines.append(b"D " + quote_path(path))
+                    base = oldsha if oldmode == MODE_TREE else None
+                    lines.extend(changes(base, sha, path + b"/"))
+                    continue
+                if oldmode == MODE_TREE:
+                    lines.append(b"D " + quote_path(path))
+                if mode == MODE_GITLINK:
+                    lines.append(
+                        b"M 160000 %s %s" % (binascii.hexlify(sha), quote_path(path))
+                    )
+                    continue
+                mark = blob(sha)
+                if mark is not None:
+                    lines.append(b"M %s :%d %s" % (mode, mark, quote_path(path)))
+                else:
+                    lost.append(sha)
+            return lines
+
+        # the branch HEAD is on receives the commits, the refs are set at the end
+        ref = self.head.encode() if self.head else b"refs/heads/master"
+        for key in self.commits:
+            (tree, all_parents, headers, message) = self._commit(key)
+            hexsha = binascii.hexlify(key).decode()
+            if tree is None or self.tree(tree) is None:
+                logger.warning(f"Export History: skip commit {hexsha}, tree missing")
+                continue
+            parents = [p for p in all_parents if p in marks]
+            del lost[:]
+            lines = changes(
+                self._commit(parents[0])[0] if parents else None, tree, b""
+            )
+            rewritten = sorted(
+                name.decode("ascii", "replace")
+                for name in headers.keys() - COMMIT_HEADERS
+            )
+            if b"author" not in headers or b"committer" not in headers:
+                rewritten.append("author/committer")
+            if len(parents) < len(all_parents):
+                rewritten.append("parents")
+            if lost:
+                rewritten.append("files")
+            if rewritten:
+                logger.warning(
+                    f"Export History: commit {hexsha} rewritten, loses "
+                    + ", ".join(rewritten)
+                )
+            if rewritten or changed.intersection(parents):
+                changed.add(key)
+            marks[key] = len(marks) + len(blobs) + 1
+            unknown = b"Unknown <unknown> 0 +0000"
+            if not parents:
+                # without "from" a commit would follow the tip of the branch
+                f.write(b"reset %s\n\n" % ref)
+            f.write(b"commit %s\nmark :%d\n" % (ref, marks[key]))
+            f.write(b"author %s\n" % headers.get(b"author", [unknown])[0])
+            f.write(b"committer %s\n" % headers.get(b"committer", [unknown])[0])
+            f.write(b"data %d\n%s\n" % (len(message), message))
+            if parents:
+                f.write(b"from :%d\n" % marks[parents[0]])
+                for parent in parents[1:]:
+                    f.write(b"merge :%d\n" % marks[parent])
+            f.write(b"".join(line + b"\n" for line in lines) + b"\n")
+        if changed:
+            logger.warning(
+                f"Export History: {len(changed)} commits get a new id on import"
+            )
+        for name, key in sorted(self.refs.items()):
+            if name == "HEAD" or key not in marks:
+                continue
+            if name in self.tags:
+                if self._tag(f, name, key, marks[key]):
+                    continue
+                logger.warning(f"Export History: {name} exported as a lightweight tag")
+            f.write(b"reset %s\nfrom :%d\n\n" % (name.encode(), marks[key]))
+        return len([mark for mark in blobs.values() if mark])
+
+    def _tag(self, f, name, key, mark):
+        """
+        @desc:  Write the annotated tag of ref name, which has to point
+                straight at commit key, return False if it cannot be
+        """
+        (headers, message) = parse_commit_headers(self.tags[name])
+        tagged = headers.get(b"object", [b""])[0]
+        if not name.startswith("refs/tags/") or tagged != binascii.hexlify(key):
+            return False
+        # a signature is part of the message of a tag, it is kept as is
+        f.write(b"tag %s\nfrom :%d\n" % (name[len("refs/tags/"):].encode(), mark))
+        if b"tagger" in headers:
+            f.write(b"tagger %s\n" % headers[b"tagger"][0])
+        f.write(b"data %d\n%s\n" % (len(message), message))
+        return True
@@ -8,90 +8,227 @@ See the file 'LICENCE' for copying permission
 """
 
 import binascii
-import collections
-import mmap
+import json
 import os
 import re
-import struct
 import subprocess
+import threading
+import time
+import urllib.parse as urlparse
 import zlib
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    wait,
+)
+from lib import metrics
 from lib.common import (
-    check,
+    ThreadPool,
     mkdir_p,
     readFile,
     writeFile,
 )
+from lib.graph import (
+    BLOB,
+    COMMIT,
+    TAG,
+    TREE,
+    ObjectGraph,
+)
+from lib.index import parse_index
+from lib.journal import (
+    CORRUPT,
+    MISSING,
+    OK,
+    PENDING,
+)
+from lib.objects import (
+    MODE_GITLINK,
+    MODE_TREE,
+    parse_commit,
+    parse_tree,
+)
+from lib.pack import (
+    Pack,
+    PackIndex,
+)
 from lib.data import (
-    paths,
+    conf,
     logger,
     target,
 )
+from lib.repo import (
+    init_repository,
+    list_refs,
+    write_atomic,
+    write_ref,
+)
 from lib.request import (
-    request_data,
+    RangeFile,
+    list_directory,
     wget,
 )
+from lib.schedule import (
+    TIER_HEAD,
+    TIER_HISTORY,
+    PathFilter,
+    Scheduler,
+)
 from lib.settings import DEBUG
+from lib.store import ObjectStore
+
+# objects found in packs are handed to a worker this many at a time
+PACKED_BATCH = 64
+
+STORE_LOCK = threading.Lock()
 
 
 def init():
     logger.info("Initialize Git")
-    cmd = ["git", "config", "--global", "init.defaultBranch", "master"]
-    ret = subprocess.call(cmd)
-    if ret != 0:
-        logger.warning("Configure Error")
-        return False
-    process = subprocess.Popen(
-        ["git", "init", paths.GITHACK_DIST_TARGET_PATH],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = process.communicate()
-    if stderr:
-        logger.error(f"Initialize Git Error: {stderr.decode('utf-8')}")
+    init_repository(target.TARGET_GIT_PATH)
 
 
+@metrics.timed("git_clone")
 def clone():
     logger.info("Clone")
-    cmd = ["git", "clone", target.TARGET_GIT_URL, paths.GITHACK_DIST_TARGET_PATH]
+    cmd = [conf.GIT, "clone", target.TARGET_GIT_URL, target.TARGET_PATH]
     ret = subprocess.call(cmd)
     if ret != 0:
-        mkdir_p(paths.GITHACK_DIST_TARGET_PATH)
+        mkdir_p(target.TARGET_PATH)
         logger.warning("Clone Error")
         return False
     return True
 
 
 def valid_git_repo():
+    """
+    Check the dump in-process: HEAD has to resolve to a commit whose tree
+    is complete on disk. Objects missing from older history or other refs
+    are reported but do not fail the check. The full report is saved as
+    JSON next to the journal.
+    """
     logger.info("Valid Repository")
-    process = subprocess.Popen(
-        ["git", "-C", paths.GITHACK_DIST_TARGET_PATH, "reset"],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.PIPE,
-    )
-    stdout, stderr = process.communicate()
-    if stderr:
-        logger.info("Valid Repository Fail")
+    refs = list_refs(target.TARGET_GIT_PATH)
+    head = refs.get("HEAD")
+    if head is None:
+        logger.info("Valid Repository Fail: HEAD does not resolve")
         return False
+    load_packs(remote=False)
+    try:
+        graph = target.GRAPH = analyze_repository(refs)
+    finally:
+        close_packs()
+    report = graph.report()
+    writeFile(target.TARGET_REPORT, json.dumps(report, indent=2).encode())
+    logger.info(f"Objects: {graph.summary()}")
+    if not graph.complete(binascii.unhexlify(head)):
+        logger.info("Valid Repository Fail: the tree of HEAD is incomplete")
+        return False
+    if graph.missing:
+        logger.warning(
+            f"History is incomplete: {len(graph.missing)} objects are missing, "
+            f"see {target.TARGET_REPORT}"
+        )
     logger.success("Valid Repository Success")
     return True
 
 
-def clone_from_list(name):
-    if name[0] == "/":
-        name = name[1:]
-    tmppath = os.path.join(paths.GITHACK_DIST_TARGET_GIT_PATH, name)
-    if tmppath[-1] == "/" and not os.path.exists(tmppath):
-        os.makedirs(tmppath)
-    if not os.path.isdir(tmppath):
-        readorwget(name)
-        return
-    page = request_data(f"{target.TARGET_GIT_URL}{name}")
-    files = re.findall(r'<a href="(.+?)"', page, re.M | re.I)
-    for f in files:
-        if f == "../":
+def analyze_repository(refs):
+    """
+    ObjectGraph of everything reachable from refs ({name: 40-hex sha})
+    with the objects on disk only, nothing is fetched. Blobs are looked
+    up, not inflated.
+    """
+    graph = ObjectGraph()
+    stack = []
+    for name, sha in sorted(refs.items()):
+        key = binascii.unhexlify(sha)
+        graph.add_root(key, name)
+        stack.append((key, None))
+    seen = {key for (key, _) in stack}
+    while stack:
+        (key, objtype) = stack.pop()
+        if objtype == BLOB:
+            if has_object(key):
+                graph.add(key, BLOB)
+            else:
+                graph.add_missing(key)
             continue
-        newname = os.path.join(name, f)
-        clone_from_list(newname)
+        obj = local_object(key)
+        if obj is None:
+            graph.add_missing(key)
+            continue
+        children = [(sha, t) for (sha, t, _) in parse_object(obj, key)]
+        graph.add(key, obj[0], children)
+        for child in children:
+            if child[0] not in seen:
+                seen.add(child[0])
+                stack.append(child)
+    return graph
+
+
+def clone_from_list(name="/"):
+    """
+    Mirror the .git folder through its directory listing, breadth-first:
+    listing pages and files are fetched by a pool of workers, files
+    already on disk are not requested again
+    """
+    logger.info("Crawl Directory Listing")
+    seen = set()
+    files = 0
+    with ThreadPool(max_workers=conf.THREADS) as executor:
+        pending = {}
+
+        def enqueue(relpath):
+            nonlocal files
+            if relpath in seen:
+                return
+            seen.add(relpath)
+            filepath = os.path.join(target.TARGET_GIT_PATH, relpath)
+            if not relpath or relpath.endswith("/"):
+                mkdir_p(filepath)
+                url = f"{target.TARGET_GIT_URL}{urlparse.quote(relpath)}"
+                pending[executor.submit(list_directory, url)] = relpath
+            else:
+                files += 1
+                if not os.path.exists(filepath):
+                    pending[executor.submit(fetchfile, relpath)] = relpath
+
+        enqueue(name.lstrip("/"))
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                relpath = pending.pop(future)
+                try:
+                    result = future.result()
+                except Exception as e:
+                    logger.warning(f"Fetch {relpath} Fail: {e}")
+                    continue
+                if relpath and not relpath.endswith("/"):
+                    continue
+                for link in result or ():
+                    child = listing_child(relpath, link)
+                    if child is not None:
+                        enqueue(child)
+    logger.info(f"Crawl Directory Listing End ({files} files)")
+
+
+def listing_child(relpath, href):
+    """
+    Path (relative to .git/) of a link found on the listing page of relpath,
+    None for parent, sorting and foreign links. Links may be relative
+    (Apache, nginx) or absolute paths (IIS, Tomcat).
+    """
+    href = href.split("#")[0]
+    if not href or "?" in href:
+        return None
+    page = f"{target.TARGET_GIT_URL}{urlparse.quote(relpath)}"
+    url = urlparse.urljoin(page, href)
+    if url == page or not url.startswith(page):
+        return None
+    child = urlparse.unquote(url[len(target.TARGET_GIT_URL) :])
+    if not safe_path(child.rstrip("/")):
+        return None
+    return child
 
 
 def refresh_files():
@@ -113,31 +250,63 @@ def clone_from_cache():
     refs = readorwget("HEAD")[5:-1]
     readorwget("index")
     readorwget("logs/HEAD", True)
-    HEAD_HASH = readorwget(refs.decode())
+    HEAD_HASH = readorwget(refs.decode()) or packed_ref(refs)
     readorwget(f"logs/refs/heads/{refs.split(b'/')[-1].decode()}")
-
-    if HEAD_HASH:
-        cache_commits(HEAD_HASH.replace(b"\n", b""))
-
     readorwget("logs/refs/remote/master")
     readorwget("logs/refs/stash")
     STASH_HASH = readorwget("refs/stash")
-    if STASH_HASH:
-        cache_commits(STASH_HASH.replace(b"\n", b""))
+
+    clone_pack()
+    roots = [h.replace(b"\n", b"") for h in (HEAD_HASH, STASH_HASH) if h]
+    # the other refs known (packed-refs: tags, branches, remotes) are walked
+    # too, the check of the dump starts from every one of them
+    roots += list(list_refs(target.TARGET_GIT_PATH).values())
+    roots = list(dict.fromkeys(roots))
+    if roots:
+        cache_commits(*roots)
 
     cache_objects()
+    close_packs()
 
 
-def readorwget(filename, refresh=False):
-    filepath = os.path.join(paths.GITHACK_DIST_TARGET_GIT_PATH, filename)
+def packed_ref(ref):
+    """
+    Look a ref up in packed-refs, refs are packed by "git gc"
+    """
+    data = readorwget("packed-refs")
+    if data:
+        m = re.search(rb"^([a-f0-9]{40}) " + re.escape(ref) + rb"$", data, re.M)
+        if m:
+            return m.group(1)
+    return None
+
+
+def fetchfile(filename, refresh=False):
+    """
+    Download filename unless it is already on disk, return its local path
+    """
+    filepath = os.path.join(target.TARGET_GIT_PATH, filename)
+    journal = target.get("JOURNAL")
     if refresh or not os.path.exists(filepath):
         logger.info(filename)
-        wget(filename)
+        status = wget(filename)
+        if journal:
+            if os.path.exists(filepath):
+                journal.set_file(filename, OK)
+            elif status == 404:
+                journal.set_file(filename, MISSING)
     else:
         if DEBUG:
             logger.info(f"[Skip] File {filename} already exists.")
     if not os.path.exists(filepath):
         return None
+    return filepath
+
+
+def readorwget(filename, refresh=False):
+    filepath = fetchfile(filename, refresh)
+    if filepath is None:
+        return None
     return readFile(filepath)
 
 
@@ -146,12 +315,8 @@ def parse_refs(data):
         fetch_heads = re.findall(r"([a-z0-9]{40})\trefs/heads/(.+?)\n", data, re.M)
         FETCH_HEAD = ""
         for index in fetch_heads:
-            writeFile(
-                os.path.join(
-                    paths.GITHACK_DIST_TARGET_GIT_PATH,
-                    f"refs/remotes/origin/{index[1]}",
-                ),
-                f"{index[0]}\n",
+            write_ref(
+                target.TARGET_GIT_PATH, f"refs/remotes/origin/{index[1]}", index[0]
             )
             FETCH_HEAD += f"{index[0]}\tnot-for-merge\t'{index[1]}' of {target.TARGET_GIT_URL[:-5]}\n"
 
@@ -166,7 +331,7 @@ def parse_refs(data):
         url = {target.TARGET_GIT_URL[:-1]}
         fetch = +refs/heads/*:refs/remotes/origin/*
     """
-        writeFile(os.path.join(paths.GITHACK_DIST_TARGET_GIT_PATH, "config"), config)
+        write_atomic(os.path.join(target.TARGET_GIT_PATH, "config"), config.encode())
     except Exception as e:
         logger.warning("Parse refs Fail")
 
@@ -175,240 +340,552 @@ def clone_pack():
     logger.info("Clone pack data.")
     packdata = readorwget("objects/info/packs")
     if packdata:
-        packs = re.findall(r"P pack-([a-z0-9]{40}).pack\n", packdata)
+        packs = re.findall(rb"P pack-([a-z0-9]{40}).pack\n", packdata)
         for pack in packs:
-            readorwget(f"objects/pack/pack-{pack}.idx")
-            readorwget(f"objects/pack/pack-{pack}.pack")
+            readorwget(f"objects/pack/pack-{pack.decode()}.idx")
+            if not conf.RANGE:
+                fetchfile(f"objects/pack/pack-{pack.decode()}.pack")
+    load_packs()
     logger.info("Clone pack data end.")
 
 
-def cache_commits(starthash):
+def load_packs(remote=None):
+    """
+    Open every downloaded pack so objects can be read without git.
+    In range mode (or with remote=True) a pack whose index is the only
+    part on disk is read remotely, fetching just the entries the walk
+    asks for. Packs on disk come first in target.PACKS.
+    """
+    remote = conf.RANGE if remote is None else remote
+    target.PACKS = []
+    packdir = os.path.join(target.TARGET_GIT_PATH, "objects", "pack")
+    if not os.path.isdir(packdir):
+        return
+    def on_disk(name):
+        return os.path.exists(os.path.join(packdir, name[:-4] + ".pack"))
+
+    names = sorted(name for name in os.listdir(packdir) if name.endswith(".idx"))
+    for name in sorted(names, key=lambda name: not on_disk(name)):
+        packfile = os.path.join(packdir, name[:-4] + ".pack")
+        data = None
+        try:
+            if not os.path.exists(packfile):
+                if not remote:
+                    continue
+                data = RangeFile(
+                    f"{target.TARGET_GIT_URL}objects/pack/{name[:-4]}.pack", packfile
+                )
+            index = PackIndex(os.path.join(packdir, name))
+            target.PACKS.append(
+                Pack(packfile, index, external=read_loose_object, data=data)
+            )
+            logger.info(f"Load pack {name[:-4]} ({len(index)} objects)")
+        except (ValueError, OSError) as e:
+            logger.warning(f"Load pack {name[:-4]} Fail: {e}")
+
+
+def close_packs():
+    for pack in target.get("PACKS", ()):
+        if hasattr(pack.data, "summary"):
+            logger.info(f"Range {os.path.basename(pack.filename)}: {pack.data.summary()}")
+        pack.close()
+        pack.index.close()
+    target.PACKS = []
+
+
+@metrics.timed("cache_commits")
+def cache_commits(*starthashes):
+    """
+    Walk the object graph reachable from starthashes with a bounded pool
+    of workers, parsing each object as soon as it has been downloaded.
+    Every object is fetched and parsed once, however many commits or
+    trees refer to it. The order comes from a Scheduler: the tree of the
+    first start hash (HEAD) before the history, newest commits first;
+    no new fetch starts once the budget of the target is spent.
+    """
     logger.info("Fetch Commit Objects")
-    indexhash = [starthash]
-    while indexhash:
-        tmp = []
-        for i in indexhash:
-            if DEBUG:
-                logger.info(f"Fetch Commit Objects: {i}")
-            data = get_objects(i)
-            try:
-                objdata = zlib.decompress(data)
-                if objdata[:4] == b"tree":
-                    trees = parse_tree(objdata[objdata.find(b"\x00") + 1 :])
-                    tmp.extend(trees)
-            except Exception as e:
-                pass
-            (obj, parents) = parse_commit(data, i)
-            if parents:
-                tmp.extend(parents)
-            if obj is None:
-                continue
-            data = get_objects(obj)
+    journal = target.get("JOURNAL")
+    previous = target.get("GRAPH")
+    graph = target.GRAPH = ObjectGraph()
+    queue = Scheduler(conf.PRIORITY, conf.ONLY)
+    seen = set()
+    stored = set()
+    lost = set()
+    resume = []
+    if journal:
+        # objects already walked are not fetched again while they are on
+        # disk, the pending ones are the frontier of the interrupted run
+        seen.update(journal.objects())
+        stored.update(journal.objects(OK))
+        # found missing by the check of the existing dump, resumed below
+        lost = previous.missing & stored if previous is not None else set()
+        stored -= lost
+        resume = journal.objects(PENDING) + journal.objects(CORRUPT) + list(lost)
+    # (type, tier, commit time, path) of the objects being fetched, the walk
+    # is keyed by 20-byte shas
+    inflight = {}
+    with ThreadPool(max_workers=conf.THREADS) as executor:
+        pending = {}
+
+        def enqueue(keys):
+            retVal = []
+            for key in keys:
+                if key in seen:
+                    # objects on disk are walked again (without a request)
+                    # once some were lost, what they lead to may be lost too
+                    if key not in stored or (not lost and has_object(key)):
+                        continue
+                    stored.discard(key)
+                seen.add(key)
+                retVal.append(key)
+            return retVal
+
+        def dispatch():
+            """
+            Hand the most urgent objects to the workers, keeping just
+            enough in flight for them not to wait
+            """
+            packed = []
+            while queue and len(pending) < conf.THREADS * 2 and not budget_spent():
+                (key, meta) = queue.pop()
+                inflight[key] = meta
+                if DEBUG:
+                    logger.info(f"Fetch Commit Objects: {key.hex()}")
+                if any(key in pack for pack in target.get("PACKS", ())):
+                    # objects found in packs are read in batches, so that
+                    # remote packs fetch their byte ranges in merged requests
+                    packed.append(key)
+                    if len(packed) >= PACKED_BATCH:
+                        pending[executor.submit(read_objects, packed)] = packed
+                        packed = []
+                else:
+                    pending[executor.submit(read_objects, [key])] = [key]
+            if packed:
+                pending[executor.submit(read_objects, packed)] = packed
+
+        def drain():
+            """
+            Walk until no fetch is left, return the objects which failed
+            for a transient reason
+            """
+            failed = []
+            dispatch()
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    keys = pending.pop(future)
+                    try:
+                        objs = future.result()
+                    except Exception as e:
+                        for key in keys:
+                            logger.warning(f"Fetch Object({key.hex()}) Fail: {e}")
+                        failed.extend((key, inflight.pop(key)) for key in keys)
+                        continue
+                    for key, obj in objs:
+                        meta = inflight.pop(key)
+                        commit = (
+                            parse_commit(obj[1])
+                            if obj is not None and obj[0] == COMMIT
+                            else None
+                        )
+                        refs = parse_object(obj, key, commit)
+                        children = enqueue([sha for (sha, _, _) in refs])
+                        status = object_status(key, obj) if journal else None
+                        if commit is not None and commit.tree is not None:
+                            logger.info(f"Get obj from commit : {commit.tree.decode()}")
+                        if obj is not None:
+                            metrics.inc("objects_total", obj[0].decode())
+                            graph.add(key, obj[0], [(sha, t) for (sha, t, _) in refs])
+                        elif status in (MISSING, CORRUPT):
+                            graph.add_missing(key)
+                        else:
+                            failed.append((key, meta))
+                        (queued, skipped) = schedule(
+                            obj, meta, refs, set(children), commit
+                        )
+                        if journal:
+                            # children filtered out by --only are not part
+                            # of the frontier, the journal sets them aside
+                            journal.set_objects(
+                                done=[(key, status)], pending=queued, skipped=skipped
+                            )
+                dispatch()
+            return failed
+
+        def schedule(obj, meta, refs, children, commit=None):
+            """
+            Queue the new children of obj: the tree of a commit shares
+            its tier, parents belong to the history and inherit the
+            commit time, tree entries extend the path. Return the (key,
+            type, tier, time, path) of the children queued and the (key,
+            path, tier, time) of the ones filtered out.
+            """
+            (_, tier, when, path) = meta
+            if commit is not None:
+                when = commit.commit_time or when
+            queued = []
+            skipped = []
+            for (key, objtype, name) in refs:
+                if key not in children:
+                    continue
+                (childtier, child) = (tier, None)
+                if obj[0] == COMMIT:
+                    if objtype == TREE:
+                        child = ""
+                    else:
+                        (objtype, childtier) = (COMMIT, TIER_HISTORY)
+                elif obj[0] == TREE and path is not None:
+                    # tree paths end with a slash, blob paths are file names
+                    child = path + name.decode("utf-8", "replace")
+                    if objtype == TREE:
+                        child += "/"
+                if not queue.push(key, objtype, childtier, when, child):
+                    skipped.append((key, child, childtier, when))
+                    continue
+                queued.append((key, objtype, childtier, when, child))
+            return (queued, skipped)
+
+        starts = []
+        for objhash in starthashes:
             try:
-                objdata = zlib.decompress(data)
-                if objdata[:4] == b"tree":
-                    trees = parse_tree(objdata[objdata.find(b"\x00") + 1 :])
-                    tmp.extend(trees)
-            except Exception as e:
-                pass
-        indexhash = tmp
-    logger.info("Fetch Commit Objects End")
-
-
-def parse_tree(text, strict=False):
-    count = 0
-    retVal = []
-    l = len(text)
-    while count < l:
-        mode_end = text.index(b" ", count)
-        mode_text = text[count:mode_end]
-        if strict and mode_text.startswith(b"0"):
-            logger.warning(f"Invalid mode '{mode_text}'")
-            break
-        try:
-            mode = int(mode_text, 8)
-        except ValueError:
-            logger.warning(f"Invalid mode '{mode_text}'")
-            break
-        name_end = text.index(b"\0", mode_end)
-        name = text[mode_end + 1 : name_end]
-        count = name_end + 21
-        sha = text[name_end + 1 : count]
-        if len(sha) != 20:
-            logger.warning("Sha has invalid length")
-            break
-        hexsha = sha_to_hex(sha)
-        retVal.append(hexsha)
-    return retVal
-
-
-def sha_to_hex(sha):
-    hexsha = binascii.hexlify(sha)
-    assert len(hexsha) == 40, f"Incorrect length of sha1 string: {len(hexsha)}"
-    return hexsha
-
-
-def parse_commit(data, commithash):
-    obj = None
-    try:
-        de_data = zlib.decompress(data)
-        m = re.search(
-            rb"commit \d+?\x00tree ([a-z0-9]{40})\n", de_data, re.M | re.S | re.I
-        )
+                starts.append(binascii.unhexlify(objhash))
+            except (binascii.Error, ValueError):
+                logger.warning(f"Invalid object hash '{objhash}'")
+        # HEAD first, then the other roots (stash) as the newest history
+        roots = [
+            (key, COMMIT, TIER_HEAD, 0, None)
+            if n == 0 and key == starts[0]
+            else (key, COMMIT, TIER_HISTORY, time.time(), None)
+            for n, key in enumerate(enqueue(starts))
+        ]
+        if journal:
+            journal.set_objects(pending=roots)
+        if resume:
+            logger.info(f"Resume {len(resume)} pending objects")
+            # the frontier of an interrupted run is queued as it was, with
+            # its path under --only and --priority; objects queued without
+            # a record (corrupt or lost ones) are the most urgent
+            frontier = journal.frontier()
+            refiltered = []
+            for key in resume:
+                if key not in frontier:
+                    graph.add_root(key)
+                    queue.push(key, urgent=True)
+                elif queue.push(key, *frontier[key]):
+                    graph.add_root(key)
+                else:
+                    (_, tier, when, path) = frontier[key]
+                    refiltered.append((key, path, tier, when))
+            journal.set_objects(skipped=refiltered)
+        if journal:
+            # blobs left out by an earlier --only, queued if this run's
+            # filter lets them through
+            unskipped = []
+            for (key, path, tier, when) in journal.skipped():
+                if key in seen:
+                    continue
+                seen.add(key)
+                if queue.push(key, BLOB, tier, when, path):
+                    graph.add_root(key)
+                    unskipped.append((key, BLOB, tier, when, path))
+            journal.set_objects(pending=unskipped)
+        for entry in roots:
+            graph.add_root(entry[0])
+            queue.push(*entry)
+        failed = drain()
+        if failed and not budget_spent():
+            # one more round for transient failures, the objects hiding
+            # the most of the graph first
+            logger.info(f"Retry {len(failed)} objects")
+            metas = dict(failed)
+            for key in graph.blocking(list(metas)):
+                (objtype, tier, when, path) = metas[key]
+                queue.push(key, objtype, tier, when, path, urgent=True)
+            failed = drain()
+        if queue and budget_spent():
+            logger.warning(f"Budget spent, {len(queue)} objects left for a later run")
+        for (key, _) in failed:
+            graph.add_missing(key)
+    if queue.skipped:
+        logger.info(f"{queue.skipped} blobs skipped by --only")
+    logger.info(f"Fetch Commit Objects End ({len(seen)} objects)")
+    logger.info(f"Walk: {graph.summary()}")
+
+
+def object_status(key, obj):
+    """
+    Journal status of a walked object, objects which could not be fetched
+    for a transient reason stay pending
+    """
+    if obj is not None:
+        return OK
+    hexsha = key.hex()
+    status = target.JOURNAL.file_status(f"objects/{hexsha[:2]}/{hexsha[2:]}")
+    return status if status in (MISSING, CORRUPT) else PENDING
+
+
+def parse_object(obj, key, commit=None):
+    """
+    Return the (20-byte sha, type, name) of the objects an object refers
+    to: commit -> tree + parents, tree -> entries, tag -> its object,
+    blob -> nothing. Gitlinks (commits of submodules) are left out.
+    commit is the Commit of obj when the caller parsed it already.
+    """
+    if obj is None:
+        return []
+    (objtype, data) = obj
+    if objtype == TREE:
+        return [
+            (sha, TREE if mode == MODE_TREE else BLOB, name)
+            for (mode, name, sha) in parse_tree(data)
+            if mode != MODE_GITLINK
+        ]
+    if objtype == COMMIT:
+        commit = commit or parse_commit(data)
+        if commit.tree is None and DEBUG:
+            logger.warning(f"Parse Commit({key.hex()}) Fail")
+        retVal = [(binascii.unhexlify(p), COMMIT, None) for p in commit.parents]
+        if commit.tree is not None:
+            retVal.insert(0, (binascii.unhexlify(commit.tree), TREE, None))
+        return retVal
+    if objtype == TAG:
+        m = re.match(rb"object ([0-9a-f]{40})\ntype (\w+)\n", data)
         if m:
-            obj = m.group(1)
-            if obj:
-                logger.info("Get obj from commit : %s" % (obj.decode()))
-            else:
-                logger.info()
-        parents = re.findall(b"parent ([a-z0-9]{40})\n", de_data, re.M | re.S | re.I)
-    except Exception as e:
-        parents = []
-        if DEBUG:
-            logger.warning(f"Decompress Commit({commithash}) Fail")
-    return (obj, parents)
+            return [(binascii.unhexlify(m.group(1)), m.group(2), None)]
+    return []
 
 
-def get_objects(objhash):
-    folder = os.path.join(
-        paths.GITHACK_DIST_TARGET_GIT_PATH, f"objects/{objhash[:2].decode()}/"
-    )
-    if not os.path.exists(folder):
-        mkdir_p(folder)
-    data = readorwget(f"objects/{objhash[:2].decode()}/{objhash[2:].decode()}")
-    return data
+def budget_spent():
+    budget = target.get("BUDGET")
+    return budget is not None and budget.exhausted()
+
+
+def object_store():
+    """
+    ObjectStore of the current target, created on first use
+    """
+    with STORE_LOCK:
+        store = target.get("STORE")
+        if store is None:
+            store = target.STORE = ObjectStore(target.TARGET_GIT_PATH)
+        return store
+
+
+def close_store():
+    """
+    Write what is still in memory to disk and drop the cache
+    """
+    store = target.get("STORE")
+    if store is not None:
+        target.STORE = None
+        store.close()
+        logger.info(f"Objects: {store.summary()}")
 
 
+def inflate_object(src, dst):
+    """
+    Stream the content of the loose object src (a binary file) into dst,
+    the "<type> <size>\\0" header is parsed once and the body is inflated
+    chunk by chunk, so memory does not grow with the object size.
+    Return the object type.
+    """
+    decompressor = zlib.decompressobj()
+    header = b""
+    objtype = None
+    size = written = 0
+    with src as fin, open(dst, "wb") as fout:
+        while not decompressor.eof:
+            chunk = fin.read(conf.CHUNK_SIZE)
+            if not chunk:
+                raise ValueError("Truncated object")
+            while chunk:
+                data = decompressor.decompress(chunk, conf.CHUNK_SIZE)
+                chunk = decompressor.unconsumed_tail
+                if objtype is None:
+                    header += data
+                    end = header.find(b"\x00")
+                    if end == -1:
+                        if len(header) > 32:
+                            raise ValueError("Invalid object header")
+                        continue
+                    (objtype, _, size) = header[:end].partition(b" ")
+                    size = int(size)
+                    data = header[end + 1 :]
+                fout.write(data)
+                written += len(data)
+    if objtype is None or written != size:
+        raise ValueError("Object size mismatch")
+    return objtype
+
+
+def is_remote(pack):
+    return getattr(pack.data, "remote", False)
+
+
+def read_pack_object(sha):
+    """
+    (type, data) of a 20-byte sha from the packs, None when no pack has
+    it. A remote pack is only read for an object which is on disk neither
+    in a local pack nor loose, so a rerun downloads nothing it saved.
+    """
+    for pack in target.get("PACKS", ()):
+        if sha not in pack:
+            continue
+        if not is_remote(pack):
+            return pack.get(sha)
+        if object_store().has(sha):
+            return None
+        obj = pack.get(sha)
+        # remote packs are never saved whole, keep what was read
+        object_store().put(sha, *obj)
+        return obj
+    return None
+
+
+def prefetch(shas):
+    """
+    Fetch the objects of shas which only remote packs have in merged
+    Range requests
+    """
+    packs = target.get("PACKS", ())
+    remote = [pack for pack in packs if is_remote(pack)]
+    if not remote:
+        return
+    store = object_store()
+    local = [pack for pack in packs if not is_remote(pack)]
+    shas = [
+        sha
+        for sha in shas
+        if not any(sha in pack for pack in local) and not store.has(sha)
+    ]
+    for pack in remote:
+        pack.prefetch([sha for sha in shas if sha in pack])
+
+
+def read_loose_object(sha):
+    """
+    (type, data) of a 20-byte binary sha from the loose objects on disk
+    """
+    return object_store().get(sha, fetch_missing=False)
+
+
+def local_object(sha):
+    """
+    (type, data) of a 20-byte binary sha from the packs and loose objects
+    on disk, None when it is missing or unreadable; nothing is fetched
+    """
+    try:
+        return read_pack_object(sha) or read_loose_object(sha)
+    except (KeyError, ValueError, zlib.error):
+        return None
+
+
+def has_object(sha):
+    if any(sha in pack for pack in target.get("PACKS", ())):
+        return True
+    return object_store().has(sha)
+
+
+def read_objects(keys):
+    """
+    Read a batch of objects (20-byte shas) for the graph walk, prefetching
+    the ones only stored in remote packs. Loose blobs are not inflated, the
+    walk only needs their type.
+    """
+    prefetch(keys)
+    return [(key, read_object(key, blobs=False)) for key in keys]
+
+
+def read_object(key, blobs=True):
+    """
+    Return (type, data) of an object from the local packs, the loose
+    objects on disk, the remote packs, and only then fetch it as a loose
+    object. With blobs=False the data of a loose blob is None.
+    """
+    try:
+        obj = read_pack_object(key)
+        if obj is not None:
+            return obj
+    except (KeyError, ValueError, zlib.error) as e:
+        logger.warning(f"Read Pack Object({key.hex()}) Fail: {e}")
+    return object_store().get(key, blobs)
+
+
+@metrics.timed("cache_objects")
 def cache_objects():
-    for entry in parse_index(os.path.join(paths.GITHACK_DIST_TARGET_GIT_PATH, "index")):
-        if "sha1" in entry.keys():
+    try:
+        (_, entries) = parse_index(os.path.join(target.TARGET_GIT_PATH, "index"))
+    except (OSError, ValueError) as e:
+        # the objects and refs are there, only the working tree is not
+        logger.warning(f"Skip Checkout, No Usable Index: {e}")
+        return
+    # gitlinks point to commits of submodules, not to files
+    entries = [entry for entry in entries if entry.mode != 0o160000]
+    only = PathFilter(conf.ONLY)
+    if only:
+        entries = [entry for entry in entries if only(entry.name)]
+    prefetch([entry.sha for entry in entries])
+    checkout(entries)
+
+
+def safe_path(name):
+    """
+    Refuse index paths which would escape the working tree
+    """
+    parts = name.replace("\\", "/").split("/")
+    if not name or name.startswith("/") or re.match(r"[A-Za-z]:", name):
+        return False
+    return not any(part in ("", ".", "..") or part.lower() == ".git" for part in parts)
+
+
+@metrics.timed("checkout")
+def checkout(entries):
+    """
+    Write index entries to the working tree: the directories are created
+    once up front, the files are written by a pool of workers
+    """
+    logger.info("Checkout Files")
+    started = time.time()
+    entries = [entry for entry in entries if safe_path(entry.name)]
+    dirs = {os.path.dirname(entry.name) for entry in entries} - {""}
+    # creating the deepest directories creates their parents as well
+    parents = {os.path.dirname(d) for d in dirs}
+    for d in dirs - parents:
+        os.makedirs(os.path.join(target.TARGET_PATH, d), exist_ok=True)
+    with ThreadPool(max_workers=conf.THREADS) as executor:
+        sizes = list(executor.map(checkout_entry, entries))
+    elapsed = max(time.time() - started, 1e-6)
+    files = sum(1 for size in sizes if size is not None)
+    size = sum(size for size in sizes if size)
+    logger.info(
+        f"Checkout {files}/{len(entries)} files ({size} bytes) in {elapsed:.2f}s, "
+        f"{files / elapsed:.1f} files/s, {size / elapsed / 1024:.1f} KB/s"
+    )
+
+
+def checkout_entry(entry):
+    """
+    Write one index entry, return the bytes written or None on failure
+    """
+    filename = os.path.join(target.TARGET_PATH, entry.name)
+    try:
+        obj = read_pack_object(entry.sha)
+        if obj:
+            writeFile(filename, obj[1])
+            return len(obj[1])
+        if budget_spent() and not has_object(entry.sha):
+            return None
+        store = object_store()
+        objfile = store.open(entry.sha)
+        if objfile:
             try:
-                data = get_objects(entry["sha1"])
-                if data:
-                    data = zlib.decompress(data)
-                    data = re.sub(rb"blob \d+\00", b"", data)
-                    target_dir = os.path.join(
-                        paths.GITHACK_DIST_TARGET_PATH, os.path.dirname(entry["name"])
-                    )
-                    if target_dir and not os.path.exists(target_dir):
-                        os.makedirs(target_dir)
-                    with open(
-                        os.path.join(paths.GITHACK_DIST_TARGET_PATH, entry["name"]),
-                        "wb",
-                    ) as f:
-                        f.write(data)
-            except Exception as e:
-                logger.warning(f"Clone Objects({entry['sha1']}) Fail")
-
-
-def parse_index(filename, pretty=True):
-    """
-    Analyze the index
-    https://github.com/git/git/blob/master/Documentation/gitformat-index.txt
-    """
-    with open(filename, "rb") as o:
-        f = mmap.mmap(o.fileno(), 0, access=mmap.ACCESS_READ)
-
-        def read(format):
-            # "All binary numbers are in network byte order."
-            # Hence "!" = network order, big endian
-            format = "! " + format
-            bytes = f.read(struct.calcsize(format))
-            return struct.unpack(format, bytes)[0]
-
-        index = collections.OrderedDict()
-
-        # 4-byte signature, b"DIRC"
-        index["signature"] = f.read(4).decode("ascii")
-        check(index["signature"] == "DIRC", "Not a Git index file")
-
-        # 4-byte version number
-        index["version"] = read("I")
-        check(index["version"] in {2, 3}, f"Unsupported version: {index['version']}")
-
-        # 32-bit number of index entries, i.e. 4-byte
-        index["entries"] = read("I")
-
-        yield index
-
-        for n in range(index["entries"]):
-            entry = collections.OrderedDict()
-
-            entry["entry"] = n + 1
-
-            entry["ctime_seconds"] = read("I")
-            entry["ctime_nanoseconds"] = read("I")
-            if pretty:
-                entry["ctime"] = entry["ctime_seconds"]
-                entry["ctime"] += entry["ctime_nanoseconds"] / 1000000000
-                del entry["ctime_seconds"]
-                del entry["ctime_nanoseconds"]
-
-            entry["mtime_seconds"] = read("I")
-            entry["mtime_nanoseconds"] = read("I")
-            if pretty:
-                entry["mtime"] = entry["mtime_seconds"]
-                entry["mtime"] += entry["mtime_nanoseconds"] / 1000000000
-                del entry["mtime_seconds"]
-                del entry["mtime_nanoseconds"]
-
-            entry["dev"] = read("I")
-            entry["ino"] = read("I")
-
-            # 4-bit object type, 3-bit unused, 9-bit unix permission
-            entry["mode"] = read("I")
-            if pretty:
-                entry["mode"] = f"{entry['mode']:06o}"
-
-            entry["uid"] = read("I")
-            entry["gid"] = read("I")
-            entry["size"] = read("I")
-
-            entry["sha1"] = binascii.hexlify(f.read(20)).decode("ascii")
-            entry["flags"] = read("H")
-
-            # 1-bit assume-valid
-            entry["assume-valid"] = bool(entry["flags"] & (0b10000000 << 8))
-            # 1-bit extended, must be 0 in version 2
-            entry["extended"] = bool(entry["flags"] & (0b01000000 << 8))
-            # 2-bit stage (?)
-            stage_one = bool(entry["flags"] & (0b00100000 << 8))
-            stage_two = bool(entry["flags"] & (0b00010000 << 8))
-            entry["stage"] = stage_one, stage_two
-            # 12-bit name length, if the length is less than 0xFFF (else, 0xFFF)
-            namelen = entry["flags"] & 0xFFF
-
-            # 62 bytes so far
-            entrylen = 62
-
-            if entry["extended"] and (index["version"] == 3):
-                entry["extra-flags"] = read("H")
-                # 1-bit reserved
-                entry["reserved"] = bool(entry["extra-flags"] & (0b10000000 << 8))
-                # 1-bit skip-worktree
-                entry["skip-worktree"] = bool(entry["extra-flags"] & (0b01000000 << 8))
-                # 1-bit intent-to-add
-                entry["intent-to-add"] = bool(entry["extra-flags"] & (0b00100000 << 8))
-                entrylen += 2
-
-            if namelen < 0xFFF:
-                entry["name"] = f.read(namelen).decode("utf-8", "replace")
-                entrylen += namelen
-            else:
-                name = []
-                while True:
-                    byte = f.read(1)
-                    if byte == b"\x00":
-                        break
-                    name.append(byte)
-                entry["name"] = b"".join(name).decode("utf-8", "replace")
-                entrylen += 1
-
-            padlen = (8 - (entrylen % 8)) or 8
-            nuls = f.read(padlen)
-            if set(nuls) != {0}:
-                raise ValueError("padding contained non-NUL")
-
-            yield entry
-
-        f.close()
+                inflate_object(objfile, filename)
+            except (ValueError, zlib.error):
+                store.discard(entry.sha)
+                raise
+            return os.path.getsize(filename)
+    except Exception as e:
+        if os.path.exists(filename):
+            os.remove(filename)
+        logger.warning(f"Clone Objects({entry.sha1}) Fail")
+    return None
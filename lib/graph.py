@@ -0,0 +1,192 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import binascii
+import collections
+import threading
+
+COMMIT = b"commit"
+TREE = b"tree"
+BLOB = b"blob"
+TAG = b"tag"
+
+# the more a missing object can lead to, the earlier it is worth fetching:
+# a ref (whose type is not known yet) hides everything, a commit its tree
+# and the whole history behind it, a tree its subtrees and blobs, a blob
+# only itself
+TYPE_RANK = {
+    None: 4,
+    COMMIT: 3,
+    TAG: 3,
+    TREE: 2,
+    BLOB: 1,
+}
+
+
+class ObjectGraph(object):
+    """
+    Incremental connectivity of the objects reachable from the refs of a
+    dump. Objects are expected with the type their referrer implies (the
+    tree of a commit, the mode of a tree entry) and become found as they
+    are read, or missing once given up on; everything else expected is
+    still pending. The walk feeds it one object at a time, so counts and
+    the most blocking missing objects are known while it runs.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.refs = {}
+        self.expected = {}
+        self.depth = {}
+        self.referrers = collections.Counter()
+        self.found = {}
+        self.children = {}
+        self.missing = set()
+
+    def add_root(self, sha, name=None):
+        """
+        @desc:  A 20-byte sha a ref points to, its type is not known yet
+        """
+        with self.lock:
+            if name is not None:
+                self.refs[name] = sha
+            self._expect(sha, None, 0)
+
+    def _expect(self, sha, objtype, depth):
+        if sha not in self.expected or (
+            self.expected[sha] is None and objtype is not None
+        ):
+            self.expected[sha] = objtype
+        if depth < self.depth.get(sha, depth + 1):
+            self.depth[sha] = depth
+
+    def add(self, sha, objtype, children=()):
+        """
+        @desc:  sha was read, children are the (sha, type) it refers to
+        """
+        with self.lock:
+            self.found[sha] = objtype
+            self.missing.discard(sha)
+            depth = self.depth.get(sha, 0) + 1
+            if children:
+                self.children[sha] = tuple(child for child, _ in children)
+            for child, childtype in children:
+                self.referrers[child] += 1
+                self._expect(child, childtype, depth)
+
+    def add_missing(self, sha):
+        """
+        @desc:  sha could not be read and will not be retried
+        """
+        with self.lock:
+            if sha not in self.found:
+                self.missing.add(sha)
+
+    def __contains__(self, sha):
+        return sha in self.found
+
+    def counts(self):
+        """
+        @desc:  {type: {"found": n, "missing": n, "pending": n}}
+        """
+        retVal = {}
+        with self.lock:
+            for sha, objtype in self.expected.items():
+                if sha in self.found:
+                    (objtype, state) = (self.found[sha], "found")
+                elif sha in self.missing:
+                    state = "missing"
+                else:
+                    state = "pending"
+                name = (objtype or b"unknown").decode()
+                retVal.setdefault(name, {"found": 0, "missing": 0, "pending": 0})
+                retVal[name][state] += 1
+        return retVal
+
+    def blocking(self, shas=None):
+        """
+        @desc:  Objects not read yet (or shas), the ones whose absence hides
+                the most reachable data first: commits before trees before
+                blobs, then the closest to a ref, then the most referred to
+        """
+        with self.lock:
+            if shas is None:
+                shas = [sha for sha in self.expected if sha not in self.found]
+            return sorted(
+                shas,
+                key=lambda sha: (
+                    -TYPE_RANK[self.expected.get(sha)],
+                    self.depth.get(sha, 0),
+                    -self.referrers[sha],
+                    sha,
+                ),
+            )
+
+    def complete(self, sha, history=False):
+        """
+        @desc:  Whether sha and everything below it were found; the parents
+                of commits are only followed with history=True
+        """
+        stack = [sha]
+        seen = {sha}
+        with self.lock:
+            while stack:
+                sha = stack.pop()
+                objtype = self.found.get(sha)
+                if objtype is None:
+                    return False
+                children = self.children.get(sha, ())
+                if objtype == COMMIT and not history:
+                    children = children[:1]
+                for child in children:
+                    if child not in seen:
+                        seen.add(child)
+                        stack.append(child)
+        return True
+
+    def summary(self):
+        counts = self.counts()
+        return ", ".join(
+            "%s %d/%d%s"
+            % (
+                name,
+                c["found"],
+                c["found"] + c["missing"] + c["pending"],
+                f" ({c['pending']} pending)" if c["pending"] else "",
+            )
+            for name, c in sorted(counts.items())
+        )
+
+    def report(self, limit=None):
+        """
+        @desc:  JSON-serializable summary: refs, counts per type, and the
+                objects not found, most blocking first
+        """
+        counts = self.counts()
+        missing = self.blocking()
+        if limit is not None:
+            missing = missing[:limit]
+        with self.lock:
+            return {
+                "refs": {
+                    name: binascii.hexlify(sha).decode()
+                    for name, sha in sorted(self.refs.items())
+                },
+                "objects": counts,
+                "missing": [
+                    {
+                        "sha": binascii.hexlify(sha).decode(),
+                        "type": (self.expected.get(sha) or b"unknown").decode(),
+                        "state": "missing" if sha in self.missing else "pending",
+                        "depth": self.depth.get(sha, 0),
+                        "referrers": self.referrers[sha],
+                    }
+                    for sha in missing
+                ],
+            }
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import mmap
+import os
+import struct
+from lib import metrics
+from lib.pack import read_offset
+
+# "All binary numbers are in network byte order."
+# signature, version, number of entries
+INDEX_HEADER = struct.Struct("!4sII")
+
+# ctime (s, ns), mtime (s, ns), dev, ino, mode, uid, gid, size, sha1, flags:
+# the fixed 62 bytes every entry starts with
+ENTRY_HEADER = struct.Struct("!10I20sH")
+
+EXTRA_FLAGS = struct.Struct("!H")
+
+# flags
+FLAG_ASSUME_VALID = 0x8000
+FLAG_EXTENDED = 0x4000
+FLAG_STAGE = 0x3000
+FLAG_NAME_LENGTH = 0xFFF
+
+# extended flags, version 3 and later
+FLAG_SKIP_WORKTREE = 0x4000
+FLAG_INTENT_TO_ADD = 0x2000
+
+
+class IndexEntry(object):
+    """
+    One entry of the index, sha is the 20-byte binary object name
+    """
+
+    __slots__ = (
+        "ctime",
+        "mtime",
+        "dev",
+        "ino",
+        "mode",
+        "uid",
+        "gid",
+        "size",
+        "sha",
+        "flags",
+        "extra_flags",
+        "name",
+    )
+
+    def __init__(self, fields, extra_flags, name):
+        self.ctime = (fields[0], fields[1])
+        self.mtime = (fields[2], fields[3])
+        (self.dev, self.ino, self.mode, self.uid, self.gid, self.size) = fields[4:10]
+        self.sha = fields[10]
+        self.flags = fields[11]
+        self.extra_flags = extra_flags
+        self.name = name
+
+    def __repr__(self):
+        return f"<IndexEntry {self.mode:06o} {self.sha1} {self.name}>"
+
+    @property
+    def sha1(self):
+        return self.sha.hex()
+
+    @property
+    def stage(self):
+        return (self.flags & FLAG_STAGE) >> 12
+
+    @property
+    def assume_valid(self):
+        return bool(self.flags & FLAG_ASSUME_VALID)
+
+    @property
+    def skip_worktree(self):
+        return bool(self.extra_flags & FLAG_SKIP_WORKTREE)
+
+    @property
+    def intent_to_add(self):
+        return bool(self.extra_flags & FLAG_INTENT_TO_ADD)
+
+
+@metrics.timed("parse_index")
+def parse_index(filename):
+    """
+    Analyze the index, return (version, entries). Raise ValueError when
+    the file is not a Git index (a soft 404 page) or is truncated.
+    https://github.com/git/git/blob/master/Documentation/gitformat-index.txt
+    """
+    with open(filename, "rb") as o:
+        if os.fstat(o.fileno()).st_size < INDEX_HEADER.size:
+            raise ValueError("Not a Git index file")
+        data = mmap.mmap(o.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        (signature, version, count) = INDEX_HEADER.unpack_from(data, 0)
+        if signature != b"DIRC":
+            raise ValueError("Not a Git index file")
+        if version not in {2, 3, 4}:
+            raise ValueError(f"Unsupported version: {version}")
+
+        unpack = ENTRY_HEADER.unpack_from
+        find = data.find
+        entries = []
+        previous = b""
+        pos = INDEX_HEADER.size
+        for _ in range(count):
+            start = pos
+            fields = unpack(data, pos)
+            flags = fields[11]
+            pos += ENTRY_HEADER.size
+            extra_flags = 0
+            if flags & FLAG_EXTENDED and version >= 3:
+                extra_flags = EXTRA_FLAGS.unpack_from(data, pos)[0]
+                pos += EXTRA_FLAGS.size
+
+            if version == 4:
+                # the path is stored as the number of bytes to drop from
+                # the end of the previous path, then a NUL-terminated suffix
+                (strip, pos) = read_offset(data, pos)
+                end = find(b"\x00", pos)
+                name = previous[: len(previous) - strip] + data[pos:end]
+                pos = end + 1
+            else:
+                namelen = flags & FLAG_NAME_LENGTH
+                if namelen < FLAG_NAME_LENGTH:
+                    end = pos + namelen
+                else:
+                    end = find(b"\x00", pos)
+                name = data[pos:end]
+                # 1-8 NUL bytes pad the entry to a multiple of eight bytes
+                pos = start + ((end - start + 8) & ~7)
+                if data[end:pos].strip(b"\x00"):
+                    raise ValueError("padding contained non-NUL")
+
+            previous = name
+            entries.append(
+                IndexEntry(fields, extra_flags, name.decode("utf-8", "replace"))
+            )
+        return (version, entries)
+    except (struct.error, IndexError):
+        raise ValueError("Truncated index") from None
+    finally:
+        data.close()
@@ -0,0 +1,206 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import sqlite3
+import threading
+import time
+from lib.data import (
+    logger,
+    target,
+)
+from lib.request import negative
+
+OK = "ok"
+MISSING = "404"
+CORRUPT = "corrupt"
+PENDING = "pending"
+
+
+class Journal(object):
+    """
+    On-disk record (SQLite) of what a dump has fetched so far: the status
+    of every requested file and of every object of the graph walk. Objects
+    still pending are the frontier the walk resumes from after a restart,
+    with the type, tier, commit time and path they were queued with.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(
+            filename, check_same_thread=False, isolation_level=None
+        )
+        with self.lock:
+            self.conn.execute("PRAGMA journal_mode=WAL")
+            self.conn.execute("PRAGMA synchronous=NORMAL")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, status TEXT, updated REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS objects "
+                "(sha BLOB PRIMARY KEY, status TEXT, updated REAL)"
+            )
+            # how the pending objects were queued, so that a resumed walk
+            # filters and orders them (and what they lead to) as before
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS frontier "
+                "(sha BLOB PRIMARY KEY, type BLOB, tier INTEGER, time REAL, "
+                "path TEXT)"
+            )
+            # blobs left out by --only, with what it takes to queue them
+            # again on a run whose filter lets them through
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS skipped "
+                "(sha BLOB PRIMARY KEY, path TEXT, tier INTEGER, time REAL)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS missing "
+                "(url TEXT PRIMARY KEY, expires REAL)"
+            )
+
+    def file_status(self, path):
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT status FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_file(self, path, status):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (path, status, time.time()),
+            )
+
+    def objects(self, status=None):
+        """
+        @desc:  20-byte shas of the journaled objects, optionally by status
+        """
+        with self.lock:
+            if status is None:
+                rows = self.conn.execute("SELECT sha FROM objects").fetchall()
+            else:
+                rows = self.conn.execute(
+                    "SELECT sha FROM objects WHERE status = ?", (status,)
+                ).fetchall()
+        return [bytes(row[0]) for row in rows]
+
+    def set_objects(self, done=(), pending=(), skipped=()):
+        """
+        @desc:  Record the final status of processed objects, queue newly
+                found ones (sha, type, tier, commit time, path) and set
+                aside the ones filtered out (sha, path, tier, commit time)
+                in one transaction, so the frontier on disk is always
+                consistent with what has been walked
+        """
+        now = time.time()
+        with self.lock:
+            with self.conn:
+                self.conn.execute("BEGIN")
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO objects VALUES (?, ?, ?)",
+                    [(sha, status, now) for sha, status in done],
+                )
+                self.conn.executemany(
+                    "DELETE FROM frontier WHERE sha = ?",
+                    [(sha,) for sha, status in done if status != PENDING],
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO objects VALUES (?, ?, ?)",
+                    [(entry[0], PENDING, now) for entry in pending],
+                )
+                self.conn.executemany(
+                    "INSERT OR REPLACE INTO frontier VALUES (?, ?, ?, ?, ?)",
+                    [tuple(entry) for entry in pending],
+                )
+                self.conn.executemany(
+                    "DELETE FROM skipped WHERE sha = ?",
+                    [(entry[0],) for entry in pending],
+                )
+                # a pending object the filter now leaves out moves aside
+                self.conn.executemany(
+                    "DELETE FROM objects WHERE sha = ? AND status = ?",
+                    [(entry[0], PENDING) for entry in skipped],
+                )
+                self.conn.executemany(
+                    "DELETE FROM frontier WHERE sha = ?",
+                    [(entry[0],) for entry in skipped],
+                )
+                self.conn.executemany(
+                    "INSERT OR IGNORE INTO skipped VALUES (?, ?, ?, ?)", list(skipped)
+                )
+
+    def frontier(self):
+        """
+        @desc:  {sha: (type, tier, commit time, path)} of the pending objects
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT sha, type, tier, time, path FROM frontier"
+            ).fetchall()
+        return {
+            bytes(sha): (objtype and bytes(objtype), tier, when, path)
+            for (sha, objtype, tier, when, path) in rows
+        }
+
+    def skipped(self):
+        """
+        @desc:  (sha, path, tier, commit time) of the blobs left out by --only
+        """
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT sha, path, tier, time FROM skipped"
+            ).fetchall()
+        return [(bytes(sha), path, tier, when) for (sha, path, tier, when) in rows]
+
+    def missing(self):
+        """
+        @desc:  Unexpired negative cache entries, {url: expiry time}
+        """
+        with self.lock:
+            self.conn.execute("DELETE FROM missing WHERE expires <= ?", (time.time(),))
+            rows = self.conn.execute("SELECT url, expires FROM missing").fetchall()
+        return dict(rows)
+
+    def set_missing(self, entries):
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO missing VALUES (?, ?)", list(entries)
+            )
+
+    def summary(self):
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT status, COUNT(*) FROM objects GROUP BY status"
+            ).fetchall()
+        return ", ".join(f"{count} {status}" for status, count in sorted(rows))
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def open_journal():
+    """
+    Open the journal of the current target, it lives in its .git folder
+    """
+    if target.get("JOURNAL") is None:
+        target.JOURNAL = Journal(target.TARGET_JOURNAL)
+        resumed = target.JOURNAL.summary()
+        if resumed:
+            logger.info(f"Resume from journal: {resumed}")
+        negative.attach(target.JOURNAL)
+    return target.JOURNAL
+
+
+def close_journal():
+    if target.get("JOURNAL") is not None:
+        target.JOURNAL.close()
+        target.JOURNAL = None
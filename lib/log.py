@@ -51,6 +51,10 @@ class LOGGER(object):
             self.YELLOW = "\033[33m"
         # functions
         self.p = self.win_print if self.IS_WIN else self.os_print
+        # where messages go, stderr when stdout carries data (probe -o -)
+        self.stream = sys.stdout
+        # returns the text put in front of every message
+        self.prefix = lambda: ""
 
     def win_reset(self, color):
         """
@@ -58,7 +62,10 @@ class LOGGER(object):
         """
         from ctypes import windll
 
-        handler = windll.kernel32.GetStdHandle(-11)
+        # STD_OUTPUT_HANDLE or STD_ERROR_HANDLE
+        handler = windll.kernel32.GetStdHandle(
+            -12 if self.stream is sys.stderr else -11
+        )
         return windll.kernel32.SetConsoleTextAttribute(handler, color)
 
     def win_print(self, msg, color, enter=True):
@@ -67,7 +74,7 @@ class LOGGER(object):
         """
         color = color or self.BLACK
         self.win_reset(color | color | color)
-        sys.stdout.write(("%s\n" if enter else "%s") % msg)
+        self.stream.write(("%s\n" if enter else "%s") % msg)
         self.win_reset(self.RED | self.GREEN | self.BLUE)
         return self
 
@@ -76,7 +83,9 @@ class LOGGER(object):
         @desc: Color output function (for unix[osx|linux..])
         """
         color = color or self.BLACK
-        sys.stdout.write(("%s%s%s\n" if enter else "%s%s%s") % (color, msg, self.BLACK))
+        self.stream.write(
+            ("%s%s%s\n" if enter else "%s%s%s") % (color, msg, self.BLACK)
+        )
         return self
 
     def error(self, msg=""):
@@ -84,7 +93,7 @@ class LOGGER(object):
         @desc:  Error message
         @param: String{msg} Text to output
         """
-        self.p("[!] %s" % msg, self.RED)
+        self.p("[!] %s%s" % (self.prefix(), msg), self.RED)
         return self
 
     def warning(self, msg=""):
@@ -92,7 +101,7 @@ class LOGGER(object):
         @desc:  Warning message
         @param: String{msg} Text to output
         """
-        self.p("[-] %s" % msg, self.YELLOW)
+        self.p("[-] %s%s" % (self.prefix(), msg), self.YELLOW)
         return self
 
     def info(self, msg=""):
@@ -100,7 +109,7 @@ class LOGGER(object):
         @desc:  Information message
         @param: String{msg} Text to output
         """
-        self.p("[*] %s" % msg, self.CYAN)
+        self.p("[*] %s%s" % (self.prefix(), msg), self.CYAN)
         return self
 
     def success(self, msg=""):
@@ -108,5 +117,5 @@ class LOGGER(object):
         @desc:  Success message
         @param: String{msg} Text to output
         """
-        self.p("[+] %s" % msg, self.GREEN)
+        self.p("[+] %s%s" % (self.prefix(), msg), self.GREEN)
         return self
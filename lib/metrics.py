@@ -0,0 +1,255 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import bisect
+import collections
+import contextlib
+import functools
+import http.server
+import json
+import threading
+import time
+from lib.data import logger
+from lib.settings import (
+    LATENCY_BUCKETS,
+    METRICS_HOST,
+    PHASE_BUCKETS,
+)
+
+# name: (kind, label, help). Counters and histograms have at most one
+# label; the names are the ones exported to Prometheus, prefixed with
+# "githack_"
+METRICS = {
+    "requests_total": (
+        "counter",
+        "status",
+        "HTTP responses by status, attempts included; error when unreachable",
+    ),
+    "received_bytes_total": ("counter", None, "Bytes of response bodies received"),
+    "objects_total": ("counter", "type", "Objects read by the graph walk by type"),
+    "request_duration_seconds": (
+        "histogram",
+        None,
+        "Time from sending a request to reading its response",
+    ),
+    "phase_duration_seconds": (
+        "histogram",
+        "phase",
+        "Time spent in each phase (calls of concurrent phases add up)",
+    ),
+}
+
+BUCKETS = {
+    "request_duration_seconds": LATENCY_BUCKETS,
+    "phase_duration_seconds": PHASE_BUCKETS,
+}
+
+started = time.time()
+lock = threading.Lock()
+counters = collections.defaultdict(collections.Counter)
+histograms = collections.defaultdict(dict)
+
+
+class Histogram(object):
+    """
+    @desc:  Observations counted in buckets of upper bounds, plus their
+            number and their sum
+    """
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # one more for the values above the last bound (+Inf)
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def cumulative(self):
+        """
+        @desc:  [(upper bound, observations up to it)], +Inf last
+        """
+        retVal = []
+        total = 0
+        for bound, n in zip(list(self.bounds) + ["+Inf"], self.counts):
+            total += n
+            retVal.append((bound, total))
+        return retVal
+
+    def quantile(self, q):
+        """
+        @desc:  Upper bound of the bucket holding the q-quantile
+        """
+        rank = q * self.count
+        for bound, total in self.cumulative():
+            if total >= rank:
+                return bound
+        return "+Inf"
+
+
+def inc(name, label="", value=1):
+    with lock:
+        counters[name][str(label)] += value
+
+
+def observe(name, value, label=""):
+    with lock:
+        histogram = histograms[name].get(label)
+        if histogram is None:
+            histogram = histograms[name][label] = Histogram(BUCKETS[name])
+        histogram.observe(value)
+
+
+@contextlib.contextmanager
+def phase(name):
+    """
+    @desc:  Time the block as phase name
+    """
+    begin = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe("phase_duration_seconds", time.perf_counter() - begin, name)
+
+
+def timed(name):
+    """
+    @desc:  Decorator timing every call of a function as phase name
+    """
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with phase(name):
+                return func(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def snapshot():
+    """
+    @desc:  JSON-serializable copy of every metric: a counter is a number,
+            or {label value: number}; a histogram is its count, sum and
+            cumulative buckets, or {label value: histogram}
+    """
+    retVal = {"started": started, "elapsed": round(time.time() - started, 3)}
+    with lock:
+        for name, (kind, label, _) in METRICS.items():
+            if kind == "counter":
+                values = dict(sorted(counters[name].items()))
+            else:
+                values = {
+                    key: {
+                        "count": h.count,
+                        "sum": round(h.sum, 6),
+                        "buckets": {str(b): n for b, n in h.cumulative()},
+                    }
+                    for key, h in sorted(histograms[name].items())
+                }
+            if label is None:
+                values = values.get("", 0 if kind == "counter" else None)
+            retVal[name] = values
+    return retVal
+
+
+def prometheus():
+    """
+    @desc:  Every metric in the Prometheus text exposition format
+    """
+    lines = []
+    with lock:
+        for name, (kind, label, text) in METRICS.items():
+            metric = "githack_" + name
+            lines.append(f"# HELP {metric} {text}")
+            lines.append(f"# TYPE {metric} {kind}")
+            if kind == "counter":
+                values = counters[name] or ({"": 0} if label is None else {})
+                for key, value in sorted(values.items()):
+                    lines.append(f"{metric}{labels(label, key)} {value}")
+                continue
+            for key, h in sorted(histograms[name].items()):
+                for bound, n in h.cumulative():
+                    bucket = labels(label, key, le=bound)
+                    lines.append(f"{metric}_bucket{bucket} {n}")
+                lines.append(f"{metric}_sum{labels(label, key)} {h.sum}")
+                lines.append(f"{metric}_count{labels(label, key)} {h.count}")
+    return "\n".join(lines) + "\n"
+
+
+def labels(label, value, le=None):
+    pairs = [(label, value)] if label else []
+    if le is not None:
+        pairs.append(("le", le))
+    if not pairs:
+        return ""
+    text = ",".join(
+        '%s="%s"' % (k, str(v).replace("\\", "\\\\").replace('"', '\\"'))
+        for k, v in pairs
+    )
+    return "{%s}" % text
+
+
+def summary():
+    with lock:
+        statuses = ", ".join(
+            f"{status}: {n}" for status, n in sorted(counters["requests_total"].items())
+        )
+        received = counters["received_bytes_total"][""]
+        latency = histograms["request_duration_seconds"].get("")
+        percentiles = (
+            f"p50 <= {latency.quantile(0.5)}s, p95 <= {latency.quantile(0.95)}s"
+            if latency
+            else "-"
+        )
+    return "Metrics: requests (%s), %d bytes received, latency %s" % (
+        statuses or "-",
+        received,
+        percentiles,
+    )
+
+
+def write_json(filename):
+    with open(filename, "w") as f:
+        json.dump(snapshot(), f, indent=2)
+    logger.info(f"Metrics written to {filename}")
+
+
+class MetricsHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port, host=METRICS_HOST):
+    """
+    @desc:  Expose /metrics on host:port from a background thread for as
+            long as the process runs
+    """
+    server = http.server.ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Metrics on http://{host}:{server.server_address[1]}/metrics")
+    return server
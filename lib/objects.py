@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import collections
+import re
+import zlib
+from lib.data import logger
+from lib.graph import BLOB
+
+HEXDIGITS = b"0123456789abcdef"
+
+# modes of tree entries, as written in trees by git
+MODE_FILE = b"100644"
+MODE_EXECUTABLE = b"100755"
+MODE_SYMLINK = b"120000"
+MODE_TREE = b"40000"
+MODE_GITLINK = b"160000"
+
+# a tree made only of well-formed entries with canonical modes, checked in
+# one scan before the entries are cut out by another
+TREE_RE = re.compile(
+    rb"(?:(?:100644|100755|120000|40000|160000) [^\x00]+\x00.{20})*", re.S
+)
+TREE_ENTRY_RE = re.compile(rb"(\d+) ([^\x00]+)\x00(.{20})", re.S)
+
+Commit = collections.namedtuple(
+    "Commit", ("tree", "parents", "author_time", "commit_time")
+)
+
+
+def decode_object(raw, blobs=True):
+    """
+    (type, data) of a compressed loose object, inflated once. With
+    blobs=False only the header of a blob is inflated and its data is
+    None. Raise zlib.error or ValueError when it is corrupt.
+    """
+    decompressor = zlib.decompressobj()
+    head = decompressor.decompress(raw, 64)
+    end = head.find(b"\x00")
+    if end == -1:
+        raise ValueError("Invalid object header")
+    (objtype, _, size) = head[:end].partition(b" ")
+    if not blobs and objtype == BLOB:
+        return (BLOB, None)
+    data = head[end + 1 :] + decompressor.decompress(decompressor.unconsumed_tail)
+    if not size.isdigit() or len(data) != int(size):
+        raise ValueError("Object size mismatch")
+    return (objtype, data)
+
+
+def peek_type(raw):
+    """
+    Type of a compressed loose object from its first bytes
+    """
+    header = zlib.decompressobj().decompress(raw[:1024], 32)
+    return header.split(b" ")[0]
+
+
+def split_object(objdata):
+    header, _, data = objdata.partition(b"\x00")
+    return (header.split(b" ")[0], data)
+
+
+def is_hexsha(value):
+    return len(value) == 40 and not value.strip(HEXDIGITS)
+
+
+def ident_time(ident):
+    """
+    Timestamp of an author/committer value "Name <email> 1700000000 +0100"
+    """
+    parts = ident.rsplit(b" ", 2)
+    return int(parts[1]) if len(parts) == 3 and parts[1].isdigit() else 0
+
+
+def parse_commit(data):
+    """
+    Commit(tree, parents, author_time, commit_time) of a commit object,
+    read line by line up to the blank line ending the headers: the message
+    is never scanned, continuation lines (signatures) are skipped. tree is
+    None when the commit is malformed.
+    """
+    tree = None
+    parents = []
+    author_time = commit_time = 0
+    end = data.find(b"\n\n")
+    for line in data[: end if end != -1 else len(data)].split(b"\n"):
+        (key, _, value) = line.partition(b" ")
+        if key == b"parent":
+            if is_hexsha(value):
+                parents.append(value)
+        elif key == b"tree":
+            if tree is None and is_hexsha(value):
+                tree = value
+        elif key == b"author":
+            author_time = ident_time(value)
+        elif key == b"committer":
+            commit_time = ident_time(value)
+    return Commit(tree, parents, author_time, commit_time)
+
+
+def parse_tree(data):
+    """
+    (mode, name, 20-byte sha) of every entry of a tree object, the mode as
+    its octal digits (MODE_TREE, MODE_GITLINK...). A well-formed tree is
+    parsed by two regex scans without a Python step per entry; anything
+    else is read entry by entry, modes written in canonical form, up to
+    the first invalid entry.
+    """
+    if TREE_RE.fullmatch(data):
+        return TREE_ENTRY_RE.findall(data)
+    return parse_tree_strict(data)
+
+
+def parse_tree_strict(data):
+    count = 0
+    retVal = []
+    l = len(data)
+    while count < l:
+        mode_end = data.find(b" ", count)
+        name_end = data.find(b"\0", mode_end)
+        mode = data[count:mode_end]
+        try:
+            if mode_end == -1 or name_end == -1:
+                raise ValueError
+            mode = b"%o" % int(mode, 8)
+        except ValueError:
+            logger.warning(f"Invalid mode '{mode}'")
+            break
+        count = name_end + 21
+        sha = data[name_end + 1 : count]
+        if len(sha) != 20:
+            logger.warning("Sha has invalid length")
+            break
+        retVal.append((mode, data[mode_end + 1 : name_end], sha))
+    return retVal
+
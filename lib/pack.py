@@ -0,0 +1,561 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import bisect
+import collections
+import hashlib
+import mmap
+import struct
+import threading
+import zlib
+from lib.settings import PACK_CACHE_SIZE
+
+OBJ_COMMIT = 1
+OBJ_TREE = 2
+OBJ_BLOB = 3
+OBJ_TAG = 4
+OBJ_OFS_DELTA = 6
+OBJ_REF_DELTA = 7
+
+TYPE_NAMES = {
+    OBJ_COMMIT: b"commit",
+    OBJ_TREE: b"tree",
+    OBJ_BLOB: b"blob",
+    OBJ_TAG: b"tag",
+}
+
+TYPE_CODES = {name: code for code, name in TYPE_NAMES.items()}
+
+IDX_MAGIC = b"\377tOc"
+
+
+class PackIndex(object):
+    """
+    Read a pack index (.idx), version 1 or 2
+    https://github.com/git/git/blob/master/Documentation/gitformat-pack.txt
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        with open(filename, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] == IDX_MAGIC:
+            self.version = struct.unpack_from("!I", self.data, 4)[0]
+            if self.version != 2:
+                raise ValueError(f"Unsupported pack index version: {self.version}")
+            fanout = 8
+        else:
+            self.version = 1
+            fanout = 0
+        self.fanout = struct.unpack_from("!256I", self.data, fanout)
+        self.count = self.fanout[255]
+        table = fanout + 256 * 4
+        if self.version == 2:
+            # sha table, crc32 table, 32-bit offset table, 64-bit offset table
+            self.sha_table = table
+            self.sha_stride = 20
+            self.crc_table = table + 20 * self.count
+            self.offset_table = self.crc_table + 4 * self.count
+            self.large_offset_table = self.offset_table + 4 * self.count
+        else:
+            # (4-byte offset, 20-byte sha) per entry
+            self.sha_table = table + 4
+            self.sha_stride = 24
+            self.offset_table = table
+        self._sorted_offsets = None
+
+    def __len__(self):
+        return self.count
+
+    def _sha(self, n):
+        pos = self.sha_table + n * self.sha_stride
+        return self.data[pos : pos + 20]
+
+    def _offset(self, n):
+        if self.version == 1:
+            return struct.unpack_from("!I", self.data, self.offset_table + n * 24)[0]
+        offset = struct.unpack_from("!I", self.data, self.offset_table + n * 4)[0]
+        if offset & 0x80000000:
+            pos = self.large_offset_table + (offset & 0x7FFFFFFF) * 8
+            offset = struct.unpack_from("!Q", self.data, pos)[0]
+        return offset
+
+    def find(self, sha):
+        """
+        @desc:  Pack offset of a 20-byte binary sha, None if not in the pack
+        """
+        first = sha[0]
+        lo = self.fanout[first - 1] if first else 0
+        hi = self.fanout[first]
+        while lo < hi:
+            mid = (lo + hi) // 2
+            value = self._sha(mid)
+            if value < sha:
+                lo = mid + 1
+            elif value > sha:
+                hi = mid
+            else:
+                return self._offset(mid)
+        return None
+
+    def __contains__(self, sha):
+        return self.find(sha) is not None
+
+    def __iter__(self):
+        for n in range(self.count):
+            yield self._sha(n)
+
+    def entries(self):
+        for n in range(self.count):
+            yield self._sha(n), self._offset(n)
+
+    def sorted_offsets(self):
+        if self._sorted_offsets is None:
+            self._sorted_offsets = sorted(self._offset(n) for n in range(self.count))
+        return self._sorted_offsets
+
+    def close(self):
+        self.data.close()
+
+
+class Pack(object):
+    """
+    Read objects out of a packfile (.pack) through its index.
+    Deltified objects are resolved against a size-bounded cache of
+    recently inflated bases; external is called with a 20-byte sha to
+    resolve REF_DELTA bases which are not part of the pack.
+    """
+
+    def __init__(
+        self, filename, index, external=None, cache_size=PACK_CACHE_SIZE, data=None
+    ):
+        self.filename = filename
+        self.index = index
+        self.external = external
+        if data is None:
+            with open(filename, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # data is either a mmap of the local file or a lazily fetched
+        # remote view (lib.request.RangeFile)
+        self.data = data
+        self.size = len(self.data)
+        if self.data[:4] != b"PACK":
+            raise ValueError(f"Not a Git pack file: {filename}")
+        version, count = struct.unpack("!2I", self.data[4:12])
+        if version not in {2, 3}:
+            raise ValueError(f"Unsupported pack version: {version}")
+        if count != index.count:
+            raise ValueError("Pack and index object counts differ")
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = 0
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def __contains__(self, sha):
+        return sha in self.index
+
+    def get(self, sha):
+        """
+        @desc:  (type name, data) of a 20-byte binary sha, None if not in the pack
+        """
+        offset = self.index.find(sha)
+        if offset is None:
+            return None
+        return self.read_at(offset)
+
+    def prefetch(self, shas):
+        """
+        @desc:  Fetch the entries of shas (and their in-pack delta bases)
+                in as few requests as possible when the pack is remote
+        """
+        if not hasattr(self.data, "fetch"):
+            return
+        offsets = {self.index.find(sha) for sha in shas} - {None}
+        done = set()
+        while offsets:
+            self.data.fetch(sorted((o, self._end(o)) for o in offsets))
+            done |= offsets
+            bases = set()
+            for offset in offsets:
+                objtype, _, _, base = self.read_header(offset)
+                if objtype == OBJ_REF_DELTA:
+                    base = self.index.find(base)
+                if objtype in {OBJ_OFS_DELTA, OBJ_REF_DELTA} and base is not None:
+                    bases.add(base)
+            offsets = bases - done
+
+    def _end(self, offset):
+        """
+        @desc:  End of the entry starting at offset (next entry or trailer)
+        """
+        offsets = self.index.sorted_offsets()
+        n = bisect.bisect_right(offsets, offset)
+        return offsets[n] if n < len(offsets) else self.size - 20
+
+    def read_header(self, offset):
+        """
+        @desc:  Parse the entry header at offset,
+                return (type, size, data offset, delta base)
+        """
+        data = self.data
+        pos = offset
+        c = data[pos]
+        pos += 1
+        objtype = (c >> 4) & 7
+        size = c & 15
+        shift = 4
+        while c & 0x80:
+            c = data[pos]
+            pos += 1
+            size |= (c & 0x7F) << shift
+            shift += 7
+        base = None
+        if objtype == OBJ_OFS_DELTA:
+            (delta, pos) = read_offset(data, pos)
+            base = offset - delta
+        elif objtype == OBJ_REF_DELTA:
+            base = bytes(data[pos : pos + 20])
+            pos += 20
+        return objtype, size, pos, base
+
+    def _inflate(self, pos, size, end):
+        retVal = zlib.decompressobj().decompress(self.data[pos:end], size)
+        if len(retVal) != size:
+            raise ValueError(f"Corrupt pack entry at {pos}")
+        return retVal
+
+    def _cached(self, offset):
+        with self.lock:
+            value = self.cache.get(offset)
+            if value is not None:
+                self.cache.move_to_end(offset)
+            return value
+
+    def _remember(self, offset, value):
+        size = len(value[1])
+        if size > self.cache_size:
+            return
+        with self.lock:
+            if offset in self.cache:
+                return
+            self.cache[offset] = value
+            self.cache_bytes += size
+            while self.cache_bytes > self.cache_size:
+                _, (_, old) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(old)
+
+    def read_at(self, offset):
+        """
+        @desc:  (type name, data) of the entry at offset with deltas applied
+        """
+        chain = []
+        while True:
+            value = self._cached(offset)
+            if value is not None:
+                objtype, data = value
+                break
+            if hasattr(self.data, "fetch"):
+                self.data.fetch([(offset, self._end(offset))])
+            objtype, size, pos, base = self.read_header(offset)
+            if objtype in TYPE_NAMES:
+                data = self._inflate(pos, size, self._end(offset))
+                objtype = TYPE_NAMES[objtype]
+                break
+            if objtype == OBJ_OFS_DELTA:
+                chain.append((offset, self._inflate(pos, size, self._end(offset))))
+                offset = base
+            elif objtype == OBJ_REF_DELTA:
+                chain.append((offset, self._inflate(pos, size, self._end(offset))))
+                base_offset = self.index.find(base)
+                if base_offset is not None:
+                    offset = base_offset
+                    continue
+                value = self.external(base) if self.external else None
+                if value is None:
+                    raise KeyError(f"Missing delta base {base.hex()}")
+                objtype, data = value
+                offset = None
+                break
+            else:
+                raise ValueError(f"Invalid pack object type {objtype} at {offset}")
+        if offset is not None:
+            self._remember(offset, (objtype, data))
+        while chain:
+            offset, delta = chain.pop()
+            data = apply_delta(data, delta)
+            self._remember(offset, (objtype, data))
+        return objtype, data
+
+    def close(self):
+        self.data.close()
+
+
+def read_offset(data, pos):
+    """
+    Decode the variable-length integer of OFS_DELTA base offsets (also
+    used for index v4 path prefixes), return (value, next position)
+    """
+    c = data[pos]
+    pos += 1
+    value = c & 0x7F
+    while c & 0x80:
+        c = data[pos]
+        pos += 1
+        value = ((value + 1) << 7) | (c & 0x7F)
+    return value, pos
+
+
+def _delta_size(delta, pos):
+    size = shift = 0
+    while True:
+        c = delta[pos]
+        pos += 1
+        size |= (c & 0x7F) << shift
+        shift += 7
+        if not c & 0x80:
+            return size, pos
+
+
+def apply_delta(base, delta):
+    """
+    Rebuild an object from its delta base and a copy/insert instruction stream
+    """
+    src_size, pos = _delta_size(delta, 0)
+    dst_size, pos = _delta_size(delta, pos)
+    if src_size != len(base):
+        raise ValueError("Delta base size mismatch")
+    out = bytearray()
+    length = len(delta)
+    while pos < length:
+        op = delta[pos]
+        pos += 1
+        if op & 0x80:
+            offset = size = 0
+            for i in range(4):
+                if op & (1 << i):
+                    offset |= delta[pos] << (8 * i)
+                    pos += 1
+            for i in range(3):
+                if op & (0x10 << i):
+                    size |= delta[pos] << (8 * i)
+                    pos += 1
+            out += base[offset : offset + (size or 0x10000)]
+        elif op:
+            out += delta[pos : pos + op]
+            pos += op
+        else:
+            raise ValueError("Invalid delta opcode")
+    if len(out) != dst_size:
+        raise ValueError("Delta result size mismatch")
+    return bytes(out)
+
+
+def encode_size(size):
+    """
+    Little-endian base-128 size of delta headers
+    """
+    out = bytearray()
+    while True:
+        c = size & 0x7F
+        size >>= 7
+        if size:
+            out.append(c | 0x80)
+        else:
+            out.append(c)
+            return bytes(out)
+
+
+def encode_header(objtype, size):
+    """
+    Type and inflated size of a pack entry
+    """
+    c = (objtype << 4) | (size & 15)
+    size >>= 4
+    out = bytearray()
+    while size:
+        out.append(c | 0x80)
+        c = size & 0x7F
+        size >>= 7
+    out.append(c)
+    return bytes(out)
+
+
+def encode_offset(value):
+    """
+    Inverse of read_offset, for OFS_DELTA base offsets
+    """
+    out = bytearray([value & 0x7F])
+    value >>= 7
+    while value:
+        value -= 1
+        out.insert(0, 0x80 | (value & 0x7F))
+        value >>= 7
+    return bytes(out)
+
+
+DELTA_BLOCK = 16
+
+
+def create_delta(base, target):
+    """
+    Copy/insert instruction stream rebuilding target from base (the
+    inverse of apply_delta). Blocks of base are indexed by content and
+    matches are extended as far as both sides agree.
+    """
+    index = {}
+    for i in range(len(base) - DELTA_BLOCK, -1, -DELTA_BLOCK):
+        index[base[i : i + DELTA_BLOCK]] = i
+    out = bytearray(encode_size(len(base)) + encode_size(len(target)))
+    insert = bytearray()
+
+    def flush():
+        for i in range(0, len(insert), 127):
+            chunk = insert[i : i + 127]
+            out.append(len(chunk))
+            out.extend(chunk)
+        insert.clear()
+
+    pos = 0
+    size = len(target)
+    while pos < size:
+        offset = index.get(target[pos : pos + DELTA_BLOCK])
+        if offset is None:
+            insert.append(target[pos])
+            pos += 1
+            continue
+        length = DELTA_BLOCK
+        while (
+            target[pos + length : pos + length + DELTA_BLOCK]
+            == base[offset + length : offset + length + DELTA_BLOCK]
+            and pos + length + DELTA_BLOCK <= size
+        ):
+            length += DELTA_BLOCK
+        while (
+            pos + length < size
+            and offset + length < len(base)
+            and target[pos + length] == base[offset + length]
+        ):
+            length += 1
+        # take back what the pending insert shares with the match
+        while insert and offset and base[offset - 1] == insert[-1]:
+            insert.pop()
+            offset -= 1
+            pos -= 1
+            length += 1
+        flush()
+        pos += length
+        while length:
+            chunk = min(length, 0x10000)
+            op = 0x80
+            args = bytearray()
+            for i in range(4):
+                if (offset >> (8 * i)) & 0xFF:
+                    op |= 1 << i
+                    args.append((offset >> (8 * i)) & 0xFF)
+            # a size of 0x10000 is encoded as no size byte at all
+            if chunk != 0x10000:
+                for i in range(3):
+                    if (chunk >> (8 * i)) & 0xFF:
+                        op |= 0x10 << i
+                        args.append((chunk >> (8 * i)) & 0xFF)
+            out.append(op)
+            out.extend(args)
+            offset += chunk
+            length -= chunk
+    flush()
+    return bytes(out)
+
+
+class PackWriter(object):
+    """
+    Write a version 2 packfile of count objects and its version 2 index.
+    Entries are added one at a time with the 20-byte sha they are stored
+    under; a blob may be stored as an OFS_DELTA against one written before.
+    """
+
+    def __init__(self, filename, count):
+        self.filename = filename
+        self.count = count
+        self.file = open(filename, "wb")
+        self.sha1 = hashlib.sha1()
+        self.offset = 0
+        self.entries = {}
+        self._write(b"PACK" + struct.pack("!2I", 2, count))
+
+    def _write(self, data):
+        self.file.write(data)
+        self.sha1.update(data)
+        self.offset += len(data)
+
+    def add(self, sha, objtype, data, base=None, delta=None):
+        """
+        @desc:  Store data (of type name objtype) under sha, or delta if
+                it rebuilds data from the already written base sha
+        """
+        offset = self.offset
+        if base is not None:
+            entry = encode_header(OBJ_OFS_DELTA, len(delta)) + encode_offset(
+                offset - self.entries[base][0]
+            )
+            body = delta
+        else:
+            entry = encode_header(TYPE_CODES[objtype], len(data))
+            body = data
+        entry += zlib.compress(body)
+        self._write(entry)
+        self.entries[sha] = (offset, zlib.crc32(entry) & 0xFFFFFFFF)
+
+    def close(self):
+        """
+        @desc:  Append the checksum and write the index next to the pack,
+                return the pack checksum
+        """
+        if len(self.entries) != self.count:
+            self.file.close()
+            raise ValueError(
+                f"Pack header announces {self.count} objects, {len(self.entries)} written"
+            )
+        checksum = self.sha1.digest()
+        self.file.write(checksum)
+        self.file.close()
+        write_index(self.filename[:-5] + ".idx", self.entries, checksum)
+        return checksum
+
+
+def write_index(filename, entries, checksum):
+    """
+    Pack index version 2 of entries ({sha: (offset, crc32)})
+    """
+    shas = sorted(entries)
+    fanout = [0] * 256
+    for sha in shas:
+        fanout[sha[0]] += 1
+    for i in range(1, 256):
+        fanout[i] += fanout[i - 1]
+    offsets = bytearray()
+    large = bytearray()
+    for sha in shas:
+        offset = entries[sha][0]
+        if offset < 0x80000000:
+            offsets += struct.pack("!I", offset)
+        else:
+            offsets += struct.pack("!I", 0x80000000 | (len(large) // 8))
+            large += struct.pack("!Q", offset)
+    data = (
+        IDX_MAGIC
+        + struct.pack("!I", 2)
+        + struct.pack("!256I", *fanout)
+        + b"".join(shas)
+        + b"".join(struct.pack("!I", entries[sha][1]) for sha in shas)
+        + bytes(offsets)
+        + bytes(large)
+        + checksum
+    )
+    with open(filename, "wb") as f:
+        f.write(data + hashlib.sha1(data).digest())
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import asyncio
+import json
+import re
+import ssl
+import struct
+import time
+import urllib.parse as urlparse
+from lib.data import (
+    conf,
+    logger,
+)
+from lib.request import randomAgent
+from lib.settings import (
+    MAX_REDIRECTS,
+    PROBE_TIMEOUT,
+)
+
+# file, bytes asked for with a Range request
+PROBE_FILES = (
+    ("HEAD", 256),
+    ("config", 4096),
+    ("index", 12),
+)
+
+# what an exposed file is worth when ranking the targets: an index means
+# the working tree can be rebuilt, HEAD and config that .git is served
+PROBE_SCORES = {
+    "HEAD": 2,
+    "config": 1,
+    "index": 4,
+}
+
+SHA1_RE = re.compile(rb"\A[0-9a-f]{40}\s*\Z")
+CONTENT_RANGE_RE = re.compile(r"bytes \d+-\d+/(\d+)")
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+
+
+class ProbeConnection(object):
+    """
+    @desc: Minimal keep-alive HTTP/1.1 client over asyncio streams, reads
+           at most limit bytes of a body and drops the connection when
+           the rest of it would have to be skipped
+    """
+
+    def __init__(self, url, context):
+        parts = urlparse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.tls = parts.scheme == "https"
+        self.host = parts.hostname
+        self.port = parts.port or (443 if self.tls else 80)
+        self.netloc = parts.netloc
+        self.context = context if self.tls else None
+        self.reader = self.writer = None
+
+    async def request(self, path, limit):
+        """
+        @desc:  GET the first limit bytes of path, return (status, headers, body)
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.host,
+                self.port,
+                ssl=self.context,
+                server_hostname=self.host if self.tls else None,
+            )
+        self.writer.write(
+            (
+                f"GET {path} HTTP/1.1\r\n"
+                f"Host: {self.netloc}\r\n"
+                f"User-Agent: {randomAgent()}\r\n"
+                f"Range: bytes=0-{limit - 1}\r\n"
+                "Accept-Encoding: identity\r\n"
+                "Connection: keep-alive\r\n\r\n"
+            ).encode("latin-1")
+        )
+        await self.writer.drain()
+        line = await self.reader.readline()
+        parts = line.split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith(b"HTTP/"):
+            raise ValueError("Invalid HTTP response")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        body, complete = await self._body(headers, limit)
+        if not complete or headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, headers, body
+
+    async def _body(self, headers, limit):
+        """
+        @desc:  Read up to limit bytes of the body, return (body, whether
+                the connection is positioned at the next response)
+        """
+        reader = self.reader
+        if headers.get("transfer-encoding", "").lower() == "chunked":
+            body = b""
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                if size == 0:
+                    while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                        pass
+                    return body, True
+                if len(body) + size > limit:
+                    body += await reader.readexactly(limit - len(body))
+                    return body, False
+                body += await reader.readexactly(size)
+                await reader.readline()
+        if "content-length" in headers:
+            length = int(headers["content-length"])
+            body = await reader.readexactly(min(length, limit))
+            return body, length <= limit
+        return await reader.read(limit), False
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+def validate(name, body):
+    """
+    Check the content signature of a probed file, return what it tells
+    about the repository or None when it is not the real file
+    """
+    if name == "HEAD":
+        if body.startswith(b"ref: "):
+            return {"ref": body[5:].strip().decode("utf-8", "replace")}
+        if SHA1_RE.match(body):
+            return {"detached": body.strip().decode()}
+    elif name == "config":
+        if b"[core]" in body:
+            remote = re.search(rb"^\s*url\s*=\s*(\S+)", body, re.M)
+            return {"remote": remote.group(1).decode("utf-8", "replace")} if remote else {}
+    elif name == "index":
+        if body[:4] == b"DIRC" and len(body) >= 12:
+            version, count = struct.unpack("!II", body[4:12])
+            if version in {2, 3, 4}:
+                return {"version": version, "entries": count}
+    return None
+
+
+def normalize_url(url):
+    """
+    Base .git url of a target, http:// when it has no scheme; ValueError
+    when it is not an http(s) url
+    """
+    url = url.strip()
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlparse.urlsplit(url)
+    if parts.scheme.lower() not in ("http", "https") or not parts.hostname:
+        raise ValueError(f"Unsupported url: {url}")
+    return url if url.endswith("/") else url + "/"
+
+
+async def probe_target(url, context):
+    """
+    Probe one .git url, return its report. Redirects are followed; when
+    a file is redirected to the same name under another base, the next
+    files are asked there directly.
+    """
+    report = {"url": url, "score": 0, "exposed": False, "files": {}, "time": 0}
+    try:
+        base = report["url"] = normalize_url(url)
+    except ValueError as e:
+        report["error"] = str(e)
+        return report
+    conn = ProbeConnection(base, context)
+    started = time.monotonic()
+    try:
+        for name, limit in PROBE_FILES:
+            location = base + name
+            try:
+                for _ in range(MAX_REDIRECTS + 1):
+                    parts = urlparse.urlsplit(location)
+                    if (parts.scheme, parts.netloc) != (conn.scheme, conn.netloc):
+                        conn.close()
+                        conn = ProbeConnection(location, context)
+                    path = (parts.path or "/") + (
+                        "?" + parts.query if parts.query else ""
+                    )
+                    status, headers, body = await asyncio.wait_for(
+                        conn.request(path, limit), PROBE_TIMEOUT
+                    )
+                    redirect = headers.get("location")
+                    if status not in REDIRECT_CODES or not redirect:
+                        break
+                    location = urlparse.urljoin(location, redirect)
+                else:
+                    raise ValueError("Too many redirects")
+            except (OSError, EOFError, asyncio.TimeoutError, ValueError) as e:
+                conn.close()
+                report["error"] = f"{name}: {type(e).__name__} {e}".strip()
+                # the host is down or too slow, the other files would fail too
+                break
+            result = {"status": status}
+            if location != base + name:
+                result["location"] = location
+                if location.endswith("/" + name):
+                    base = report["redirect"] = location[: -len(name)]
+            found = validate(name, body) if status in (200, 206) else None
+            if found is not None:
+                result.update(found)
+                size = CONTENT_RANGE_RE.match(headers.get("content-range", ""))
+                if size:
+                    result["size"] = int(size.group(1))
+                report["score"] += PROBE_SCORES[name]
+            result["valid"] = found is not None
+            report["files"][name] = result
+    finally:
+        conn.close()
+    report["exposed"] = report["score"] > 0
+    report["time"] = round(time.monotonic() - started, 3)
+    return report
+
+
+async def probe_all(urls):
+    context = ssl.create_default_context()
+    semaphore = asyncio.Semaphore(conf.JOBS)
+
+    async def bounded(url):
+        async with semaphore:
+            return await probe_target(url, context)
+
+    return await asyncio.gather(*(bounded(url) for url in urls))
+
+
+def probe(urls, output):
+    """
+    Triage mode: check which targets expose .git without dumping them and
+    write a JSON report ranked by how much of the repository is reachable
+    """
+    logger.info(f"Probe {len(urls)} targets, {conf.JOBS} at a time")
+    started = time.time()
+    reports = asyncio.run(probe_all(urls))
+    reports.sort(key=lambda r: (-r["score"], r["time"]))
+    data = json.dumps(reports, indent=2)
+    if output == "-":
+        print(data)
+    else:
+        with open(output, "w") as f:
+            f.write(data + "\n")
+        logger.info(f"Report: {output}")
+    exposed = [r for r in reports if r["exposed"]]
+    for report in exposed:
+        logger.success(
+            "%s score %d (%s)"
+            % (
+                report["url"],
+                report["score"],
+                ", ".join(n for n, r in report["files"].items() if r["valid"]),
+            )
+        )
+    logger.info(
+        "Probe done: %d/%d exposed in %.1fs"
+        % (len(exposed), len(reports), time.time() - started)
+    )
+    return reports
@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import binascii
+import hashlib
+import os
+import re
+import tempfile
+import time
+import zlib
+from lib.common import readFile
+from lib.data import (
+    logger,
+    target,
+)
+from lib.graph import (
+    BLOB,
+    COMMIT,
+    TAG,
+    TREE,
+)
+from lib.objects import (
+    MODE_EXECUTABLE,
+    MODE_FILE,
+    parse_tree,
+    split_object,
+)
+from lib.pack import (
+    Pack,
+    PackIndex,
+    PackWriter,
+    create_delta,
+)
+from lib.request import UMASK
+from lib.settings import (
+    DELTA_DEPTH,
+    DELTA_MAX_SIZE,
+    DELTA_WINDOW,
+)
+
+LOOSE_RE = re.compile(r"\A[0-9a-f]{38}\Z")
+
+# commits first, then the trees they point to, then the blobs, like git
+WRITE_ORDER = {COMMIT: 0, TAG: 0, TREE: 1, BLOB: 2}
+
+
+def repack(deltas=False):
+    """
+    Move every loose object of the dump into a single new pack, with blobs
+    stored as deltas of similar blobs when deltas is set. The pack is read
+    back and every object checked against its sha before the loose files
+    are removed; nothing is removed when anything does not match.
+    """
+    started = time.time()
+    objdir = os.path.join(target.TARGET_GIT_PATH, "objects")
+    loose = list_loose(objdir)
+    if not loose:
+        logger.info("Repack: no loose object")
+        return False
+    objects = {}
+    for sha, filename in loose.items():
+        try:
+            obj = read_loose(sha, filename)
+        except (OSError, ValueError, zlib.error) as e:
+            logger.warning(f"Repack: skip {binascii.hexlify(sha).decode()}: {e}")
+            continue
+        objects[sha] = (obj[0], len(obj[1]), filename)
+    if not objects:
+        return False
+    order = write_order(objects, blob_names(objects) if deltas else {})
+    packdir = os.path.join(objdir, "pack")
+    os.makedirs(packdir, exist_ok=True)
+    fd, tmpfile = tempfile.mkstemp(prefix="tmp_pack_", suffix=".pack", dir=packdir)
+    os.close(fd)
+    try:
+        (checksum, ndeltas) = write_pack(tmpfile, order, objects, deltas)
+        name = "pack-" + binascii.hexlify(checksum).decode()
+        packfile = os.path.join(packdir, name + ".pack")
+        idxfile = os.path.join(packdir, name + ".idx")
+        for src, dst in ((tmpfile, packfile), (tmpfile[:-5] + ".idx", idxfile)):
+            os.chmod(src, 0o444 & ~UMASK)
+            os.replace(src, dst)
+    except BaseException:
+        for filename in (tmpfile, tmpfile[:-5] + ".idx"):
+            if os.path.exists(filename):
+                os.remove(filename)
+        raise
+    if not verify_pack(packfile, idxfile, objects):
+        logger.warning(f"Repack: {name} does not match the loose objects, keep them")
+        os.remove(idxfile)
+        os.remove(packfile)
+        return False
+    before = sum(os.path.getsize(objects[sha][2]) for sha in objects)
+    for sha in objects:
+        os.remove(objects[sha][2])
+    for folder in {os.path.dirname(objects[sha][2]) for sha in objects}:
+        try:
+            os.rmdir(folder)
+        except OSError:
+            pass
+    logger.success(
+        "Repack %d objects (%d deltas) into %s, %d -> %d bytes in %.2fs"
+        % (
+            len(objects),
+            ndeltas,
+            name,
+            before,
+            os.path.getsize(packfile) + os.path.getsize(idxfile),
+            time.time() - started,
+        )
+    )
+    return True
+
+
+def list_loose(objdir):
+    """
+    {20-byte sha: file} of the loose objects under objdir
+    """
+    retVal = {}
+    for prefix in os.listdir(objdir):
+        folder = os.path.join(objdir, prefix)
+        if len(prefix) != 2 or not os.path.isdir(folder):
+            continue
+        for name in os.listdir(folder):
+            if LOOSE_RE.match(name):
+                retVal[binascii.unhexlify(prefix + name)] = os.path.join(folder, name)
+    return retVal
+
+
+def read_loose(sha, filename):
+    """
+    (type, data) of a loose object whose content hashes to sha
+    """
+    raw = zlib.decompress(readFile(filename))
+    if hashlib.sha1(raw).digest() != sha:
+        raise ValueError("content does not match its name")
+    return split_object(raw)
+
+
+def blob_names(objects):
+    """
+    {blob sha: file name} from the trees among objects, similar files
+    tend to share a name or an extension
+    """
+    retVal = {}
+    for sha, (objtype, _, filename) in objects.items():
+        if objtype != TREE:
+            continue
+        (_, data) = read_loose(sha, filename)
+        for mode, name, child in parse_tree(data):
+            if mode in (MODE_FILE, MODE_EXECUTABLE) and child not in retVal:
+                retVal[child] = name
+    return retVal
+
+
+def write_order(objects, names):
+    """
+    Shas in the order they are written. Blobs are grouped by the reversed
+    end of their name so that same-extension files sit in the same delta
+    window, largest first: a delta removes data rather than adding it.
+    """
+    return sorted(
+        objects,
+        key=lambda sha: (
+            WRITE_ORDER.get(objects[sha][0], 3),
+            names.get(sha, b"")[-16:][::-1],
+            -objects[sha][1],
+            sha,
+        ),
+    )
+
+
+def write_pack(filename, order, objects, deltas=False):
+    """
+    Write the objects to filename (.pack) and its index, return the pack
+    checksum and the number of deltas
+    """
+    writer = PackWriter(filename, len(order))
+    window = []
+    depth = {}
+    ndeltas = 0
+    for sha in order:
+        (objtype, data) = read_loose(sha, objects[sha][2])
+        (base, delta) = (None, None)
+        if deltas and objtype == BLOB and len(data) <= DELTA_MAX_SIZE:
+            for candidate, candidate_data in window:
+                if depth.get(candidate, 0) >= DELTA_DEPTH:
+                    continue
+                # a much smaller blob cannot carry most of this one
+                if len(candidate_data) < len(data) // 2:
+                    continue
+                d = create_delta(candidate_data, data)
+                if len(d) < len(data) // 2 and (delta is None or len(d) < len(delta)):
+                    (base, delta) = (candidate, d)
+            window.append((sha, data))
+            del window[:-DELTA_WINDOW]
+        if base is not None:
+            depth[sha] = depth.get(base, 0) + 1
+            ndeltas += 1
+        writer.add(sha, objtype, data, base, delta)
+    return writer.close(), ndeltas
+
+
+def verify_pack(packfile, idxfile, objects):
+    """
+    Whether the pack holds exactly objects and each one hashes to its sha
+    """
+    index = PackIndex(idxfile)
+    pack = Pack(packfile, index)
+    try:
+        if set(index) != set(objects):
+            return False
+        for sha in objects:
+            (objtype, data) = pack.get(sha)
+            raw = b"%s %d\x00" % (objtype, len(data)) + data
+            if hashlib.sha1(raw).digest() != sha:
+                return False
+        return True
+    except (KeyError, ValueError, zlib.error):
+        return False
+    finally:
+        pack.close()
+        index.close()
@@ -0,0 +1,147 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import os
+import re
+import tempfile
+from lib.common import mkdir_p
+from lib.request import UMASK
+
+DEFAULT_BRANCH = "master"
+
+CONFIG = """[core]
+\trepositoryformatversion = 0
+\tfilemode = true
+\tbare = false
+\tlogallrefupdates = true
+"""
+
+DESCRIPTION = (
+    "Unnamed repository; edit this file 'description' to name the repository.\n"
+)
+
+SKELETON_DIRS = (
+    "branches",
+    "hooks",
+    "info",
+    "objects/info",
+    "objects/pack",
+    "refs/heads",
+    "refs/tags",
+)
+
+SHA1_RE = re.compile(rb"\A[0-9a-f]{40}\Z")
+
+
+def init_repository(gitdir, branch=DEFAULT_BRANCH):
+    """
+    Create the skeleton of a non-bare repository like "git init" does,
+    files which already exist (downloaded ones) are left alone
+    """
+    for name in SKELETON_DIRS:
+        mkdir_p(os.path.join(gitdir, name))
+    for name, data in (
+        ("HEAD", f"ref: refs/heads/{branch}\n"),
+        ("config", CONFIG),
+        ("description", DESCRIPTION),
+        ("info/exclude", ""),
+    ):
+        filename = os.path.join(gitdir, name)
+        if not os.path.exists(filename):
+            write_atomic(filename, data.encode())
+
+
+def write_atomic(filename, data):
+    """
+    Replace filename with data, readers never see a partial file
+    """
+    mkdir_p(os.path.dirname(filename))
+    fd, tmpfile = tempfile.mkstemp(
+        prefix=".", suffix=".lock", dir=os.path.dirname(filename)
+    )
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.chmod(tmpfile, 0o666 & ~UMASK)
+        os.replace(tmpfile, filename)
+    except BaseException:
+        os.remove(tmpfile)
+        raise
+
+
+def write_ref(gitdir, name, sha):
+    """
+    Point the ref name (e.g. refs/heads/master) at a 40-hex sha
+    """
+    if isinstance(sha, bytes):
+        sha = sha.decode()
+    write_atomic(os.path.join(gitdir, name), f"{sha}\n".encode())
+
+
+def read_ref(gitdir, name, depth=5):
+    """
+    Resolve a ref (HEAD, refs/heads/master...) to a 40-hex sha from the
+    files on disk, following symbolic refs and packed-refs; None when it
+    does not resolve
+    """
+    filename = os.path.join(gitdir, name)
+    if os.path.isfile(filename):
+        with open(filename, "rb") as f:
+            data = f.read().strip()
+        if data.startswith(b"ref: "):
+            return read_ref(gitdir, data[5:].decode(), depth - 1) if depth else None
+        return data if SHA1_RE.match(data) else None
+    return packed_refs(gitdir).get(name.encode())
+
+
+def symbolic_ref(gitdir, name="HEAD"):
+    """
+    Ref a symbolic ref points to (refs/heads/master), None when detached
+    """
+    filename = os.path.join(gitdir, name)
+    if not os.path.isfile(filename):
+        return None
+    with open(filename, "rb") as f:
+        data = f.read().strip()
+    return data[5:].decode() if data.startswith(b"ref: ") else None
+
+
+def packed_refs(gitdir):
+    """
+    {ref: sha} of .git/packed-refs, peeled tag lines are skipped
+    """
+    filename = os.path.join(gitdir, "packed-refs")
+    if not os.path.isfile(filename):
+        return {}
+    with open(filename, "rb") as f:
+        data = f.read()
+    return {
+        ref: sha
+        for sha, ref in re.findall(rb"^([0-9a-f]{40}) (\S+)$", data, re.M)
+    }
+
+
+def list_refs(gitdir):
+    """
+    {name: 40-hex sha} of HEAD and of every ref on disk, loose refs take
+    precedence over packed-refs like in git
+    """
+    retVal = {name.decode(): sha for name, sha in packed_refs(gitdir).items()}
+    refsdir = os.path.join(gitdir, "refs")
+    for root, _, files in os.walk(refsdir):
+        for filename in files:
+            name = os.path.relpath(os.path.join(root, filename), gitdir)
+            name = name.replace(os.sep, "/")
+            sha = read_ref(gitdir, name)
+            if sha is not None:
+                retVal[name] = sha
+    head = read_ref(gitdir, "HEAD")
+    if head is not None:
+        retVal["HEAD"] = head
+    return retVal
@@ -7,50 +7,678 @@ Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
 See the file 'LICENCE' for copying permission
 """
 
+import bisect
+import codecs
+import collections
+import contextlib
+import html.parser
+import http.client
+import mmap
 import os
 import random
-import urllib.error
-import urllib.request
-from lib.common import writeFile
+import ssl
+import tempfile
+import threading
+import time
+import urllib.parse as urlparse
+from lib import (
+    metrics,
+    throttle,
+)
 from lib.data import (
-    paths,
+    conf,
     target,
     agents,
     logger
 )
-from lib.settings import DEBUG
+from lib.settings import (
+    DEBUG,
+    MAX_REDIRECTS,
+    NEGATIVE_CACHE_TTL,
+    RANGE_MERGE_GAP,
+    RETRIES,
+    TIMEOUT,
+)
+
+
+# errors of the connection while consume reads the body, as opposed to
+# errors of consume itself (a full disk, a corrupt object)
+READ_ERRORS = (
+    ConnectionError,
+    TimeoutError,
+    ssl.SSLError,
+    http.client.HTTPException,
+)
+
+
+class ConnectionPool(object):
+    """
+    @desc: Keep-alive HTTP(S) connections keyed by (scheme, host, port).
+           The pool does not bound them, the requests in flight to a host
+           are (lib.throttle.HostLimiter), and a host never has more idle
+           connections than it had requests at once.
+    """
+
+    def __init__(self, timeout=TIMEOUT):
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.hosts = {}
+        self.stats = collections.Counter()
+        self.context = ssl.create_default_context()
+
+    def _idle(self, key):
+        with self.lock:
+            return self.hosts.setdefault(key, [])
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def _connect(self, scheme, host, port):
+        self._count("created")
+        if scheme == "https":
+            return http.client.HTTPSConnection(
+                host, port, timeout=self.timeout, context=self.context
+            )
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+    @contextlib.contextmanager
+    def urlopen(self, url, headers=None, method="GET"):
+        """
+        @desc:  Send a request over a pooled connection and yield the response,
+                the connection is handed back once the body has been consumed
+        """
+        parts = urlparse.urlsplit(url)
+        scheme = parts.scheme.lower()
+        if scheme not in ("http", "https"):
+            raise ValueError(f"unsupported url scheme '{parts.scheme}'")
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        path = urlparse.quote(parts.path or "/", safe="/%:@!$&'()*+,;=~")
+        if parts.query:
+            path += "?" + parts.query
+
+        idle = self._idle(key)
+        conn = response = None
+        try:
+            with self.lock:
+                conn = idle.pop() if idle else None
+            if conn is not None:
+                try:
+                    conn.request(method, path, headers=headers or {})
+                    response = conn.getresponse()
+                    self._count("reused")
+                except (http.client.HTTPException, OSError):
+                    # the server dropped the idle connection, open a new one
+                    conn.close()
+                    conn = None
+            if conn is None:
+                conn = self._connect(scheme, parts.hostname, port)
+                conn.request(method, path, headers=headers or {})
+                response = conn.getresponse()
+            self._count("requests")
+            yield response
+        finally:
+            reusable = (
+                response is not None and response.isclosed() and not response.will_close
+            )
+            if conn is not None:
+                if reusable:
+                    with self.lock:
+                        idle.append(conn)
+                else:
+                    conn.close()
+
+    def close(self):
+        with self.lock:
+            for idle in self.hosts.values():
+                while idle:
+                    idle.pop().close()
+
+    def summary(self):
+        return "Connections: %d requests, %d opened, %d reused" % (
+            self.stats["requests"],
+            self.stats["created"],
+            self.stats["reused"],
+        )
+
+
+pool = ConnectionPool()
+
+# a definite answer that the resource does not exist, not worth retrying
+MISSING_STATUS = (404, 410)
+
+
+class NegativeCache(object):
+    """
+    @desc: URLs which answered with a definite 404, remembered for ttl
+           seconds so a missing file costs a single request. Entries are
+           persisted in the journal of the current target, if it has one.
+    """
+
+    def __init__(self, ttl=NEGATIVE_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.hits = 0
+
+    def __contains__(self, url):
+        with self.lock:
+            expires = self.entries.get(url)
+            if expires is None:
+                return False
+            if expires <= time.time():
+                del self.entries[url]
+                return False
+            self.hits += 1
+            return True
+
+    def add(self, url):
+        expires = time.time() + self.ttl
+        with self.lock:
+            self.entries[url] = expires
+        journal = target.get("JOURNAL")
+        if journal is not None:
+            journal.set_missing([(url, expires)])
+
+    def attach(self, journal):
+        """
+        @desc:  Load the entries of previous runs and persist the ones
+                found before the journal was opened
+        """
+        prefix = target.TARGET_GIT_URL
+        with self.lock:
+            self.entries.update(journal.missing())
+            entries = [e for e in self.entries.items() if e[0].startswith(prefix)]
+        journal.set_missing(entries)
+
+    def summary(self):
+        return "Negative cache: %d known missing, %d requests saved" % (
+            len(self.entries),
+            self.hits,
+        )
+
+
+negative = NegativeCache()
+
+# mkstemp creates files as 0600, downloads get the usual permissions instead
+UMASK = os.umask(0)
+os.umask(UMASK)
+
+
+class RangeFile(object):
+    """
+    @desc: Read-only view of a remote file which only downloads the byte
+           ranges that are asked for, with HTTP Range requests. Fetched
+           bytes are written at their offset into a sparse file next to
+           fallback, only the bounds of what is there stay in memory, and
+           a range being fetched by a thread is waited for by the others
+           instead of fetched again. If the server ignores Range the whole
+           file is saved to fallback and read from there instead.
+    """
+
+    def __init__(self, url, fallback):
+        self.url = url
+        self.fallback = fallback
+        self.lock = threading.Lock()
+        # disjoint [start, end) ranges on disk in offset order, and the
+        # (start, end, event) of the ranges being fetched
+        self.starts = []
+        self.ends = []
+        self.inflight = []
+        self.partial = fallback + ".part"
+        self.file = open(self.partial, "w+b")
+        self.local = None
+        self.size = None
+        self.stats = collections.Counter()
+        try:
+            # the first request also tells the size of the file
+            self.fetch([(0, 12)])
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return len(self.local) if self.local is not None else self.size
+
+    @property
+    def remote(self):
+        return self.local is None
+
+    def _covered(self, start, end):
+        n = bisect.bisect_right(self.starts, start) - 1
+        return n >= 0 and self.ends[n] >= end
+
+    def __getitem__(self, key):
+        if self.local is not None:
+            return self.local[key]
+        if isinstance(key, slice):
+            start, stop, _ = key.indices(self.size)
+        else:
+            start = key % self.size
+            stop = start + 1
+        if stop <= start:
+            return b""
+        with self.lock:
+            covered = self._covered(start, stop)
+        if not covered:
+            self.fetch([(start, stop)])
+            if self.local is not None:
+                return self.local[key]
+        with self.lock:
+            if self.file is None:
+                # the whole file was downloaded meanwhile
+                return self.local[key]
+            self.file.seek(start)
+            data = self.file.read(stop - start)
+        return data if isinstance(key, slice) else data[0]
+
+    def fetch(self, ranges):
+        """
+        @desc:  Download the missing [start, end) ranges, merging ranges
+                which are adjacent or close to each other
+        """
+        if self.local is not None:
+            return
+        with self.lock:
+            missing = sorted((a, b) for a, b in ranges if not self._covered(a, b))
+        merged = []
+        for start, end in missing:
+            if merged and start <= merged[-1][1] + RANGE_MERGE_GAP:
+                merged[-1][1] = max(merged[-1][1], end)
+            else:
+                merged.append([start, end])
+        for start, end in merged:
+            if self.size is not None:
+                end = min(end, self.size)
+            self._acquire(start, end)
+            if self.local is not None:
+                return
+
+    def _acquire(self, start, end):
+        """
+        @desc:  Make [start, end) available: fetch the parts nobody has
+                fetched or is fetching, then wait for the parts other
+                threads are fetching (and take over those which failed)
+        """
+        while True:
+            with self.lock:
+                (gaps, waits) = self._gaps(start, end)
+                claimed = [(a, b, threading.Event()) for a, b in gaps]
+                self.inflight.extend(claimed)
+            if not claimed and not waits:
+                return
+            try:
+                for (a, b, _) in claimed:
+                    self._fetch(a, b)
+                    if self.local is not None:
+                        return
+            finally:
+                with self.lock:
+                    for entry in claimed:
+                        self.inflight.remove(entry)
+                for (_, _, event) in claimed:
+                    event.set()
+            for event in waits:
+                event.wait()
+
+    def _gaps(self, start, end):
+        """
+        @desc:  Parts of [start, end) neither on disk nor being fetched,
+                and the events of the fetches in flight it overlaps
+        """
+        busy = []
+        n = max(bisect.bisect_right(self.starts, start) - 1, 0)
+        while n < len(self.starts) and self.starts[n] < end:
+            busy.append((self.starts[n], self.ends[n]))
+            n += 1
+        waits = []
+        for (a, b, event) in self.inflight:
+            if a < end and b > start:
+                busy.append((a, b))
+                waits.append(event)
+        retVal = []
+        for (a, b) in sorted(busy):
+            if a > start:
+                retVal.append((start, min(a, end)))
+            start = max(start, b)
+            if start >= end:
+                break
+        if start < end:
+            retVal.append((start, end))
+        return (retVal, waits)
+
+    def _fetch(self, start, end):
+        headers = {
+            "User-Agent": randomAgent(),
+            "Range": "bytes=%d-%d" % (start, end - 1),
+        }
+
+        def consume(response):
+            if response.status == 200:
+                self._download(response)
+                return True
+            data = response.read()
+            received(len(data))
+            (first, _, total) = (
+                response.getheader("Content-Range", "").split(" ")[-1].partition("/")
+            )
+            if total.isdigit():
+                self.size = int(total)
+            self._store(int(first.split("-")[0]), data)
+            return True
+
+        (status, done) = request(self.url, headers, consume)
+        if not done:
+            raise IOError(
+                "Fetch %s bytes %d-%d failed (%s)" % (self.url, start, end - 1, status)
+            )
+        if self.local is None:
+            with self.lock:
+                covered = self._covered(start, min(end, self.size or end))
+            if not covered:
+                raise IOError(
+                    "Fetch %s bytes %d-%d: short response" % (self.url, start, end - 1)
+                )
+
+    def _store(self, start, data):
+        end = start + len(data)
+        with self.lock:
+            if self.file is None:
+                return
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(data)
+            self.file.seek(start)
+            self.file.write(data)
+            # only the bounds are merged with the ranges it overlaps or touches
+            lo = bisect.bisect_left(self.ends, start)
+            hi = bisect.bisect_right(self.starts, end)
+            if lo < hi:
+                start = min(start, self.starts[lo])
+                end = max(end, self.ends[hi - 1])
+            self.starts[lo:hi] = [start]
+            self.ends[lo:hi] = [end]
+
+    def _download(self, response):
+        logger.warning("%s ignores Range, download the whole file" % self.url)
+        save_response(response, self.fallback)
+        with open(self.fallback, "rb") as f:
+            self.local = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["bytes"] += len(self.local)
+            self.starts = []
+            self.ends = []
+            self._discard()
+
+    def _discard(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+            try:
+                os.remove(self.partial)
+            except OSError:
+                pass
+
+    def close(self):
+        if self.local is not None:
+            self.local.close()
+        with self.lock:
+            self._discard()
+
+    def summary(self):
+        return "%d bytes of %d fetched in %d requests" % (
+            self.stats["bytes"],
+            len(self),
+            self.stats["requests"],
+        )
 
 
 def randomAgent():
     return random.choice(agents)
 
 
-def request_data(url):
-    for i in range(3):
-        data = None
+@contextlib.contextmanager
+def urlopen(url, headers=None):
+    """
+    @desc:  pool.urlopen which follows redirects
+    """
+    for _ in range(MAX_REDIRECTS + 1):
+        with pool.urlopen(url, headers) as response:
+            redirect = response.getheader("Location")
+            if response.status in (301, 302, 303, 307, 308) and redirect:
+                response.read()
+                url = urlparse.urljoin(url, redirect)
+                continue
+            yield response
+            return
+    raise http.client.HTTPException("Too many redirects")
+
+
+def request(url, headers=None, consume=None):
+    """
+    @desc:  Send a request under the retry and rate limit policy, return
+            (last status, consume(response)). Only transient failures are
+            retried, with exponential backoff and jitter; a Retry-After of
+            a 429/503 holds every request to the host. Status is None when
+            the server could not be reached. Any other exception, of
+            consume or of the request itself, is raised as is: it is not
+            retried and tells nothing about the host.
+    """
+    host = throttle.limiter(urlparse.urlsplit(url).netloc)
+    status = None
+    for attempt in range(RETRIES):
+        result = None
+        wait = None
+        failure = None
+        host.acquire()
+        begin = time.perf_counter()
         try:
-            request = urllib.request.Request(url, None, {"User-Agent": randomAgent()})
-            with urllib.request.urlopen(request) as response:
-                data = response.read()
-            if data:
-                return data
-        except Exception as e:
+            with urlopen(url, headers) as response:
+                status = response.status
+                if status < 400:
+                    try:
+                        result = consume(response) if consume else response.read()
+                    except READ_ERRORS:
+                        raise
+                    except Exception as e:
+                        # the response was fine, what failed is ours
+                        failure = e
+                else:
+                    response.read()
+                    wait = throttle.retry_after(response.getheader("Retry-After"))
+        except (OSError, http.client.HTTPException) as e:
+            status = None
             if DEBUG:
                 logger.warning("Request Exception: %s" % str(e))
-    return None
+        except Exception as e:
+            failure = e
+        finally:
+            host.release(status, local=failure is not None)
+            metrics.inc("requests_total", status or "error")
+            metrics.observe("request_duration_seconds", time.perf_counter() - begin)
+        if failure is not None:
+            raise failure
+        if status is not None and status < 400:
+            return status, result
+        if status not in throttle.RETRY_STATUS or attempt == RETRIES - 1:
+            break
+        throttle.count("retries")
+        if status in (429, 503):
+            throttle.count("throttled")
+        if wait is not None:
+            # acquire() holds the next attempt until the host cooled down
+            host.cooldown(wait)
+        else:
+            time.sleep(throttle.backoff(attempt))
+    return status, None
+
+
+def received(size):
+    """
+    @desc:  Charge size bytes of response bodies to the budget of the
+            current target
+    """
+    metrics.inc("received_bytes_total", value=size)
+    budget = target.get("BUDGET")
+    if budget is not None:
+        budget.add(size)
+
+
+@metrics.timed("request_data")
+def request_data(url):
+    if url in negative:
+        return None
+    (status, data) = request(url, {"User-Agent": randomAgent()})
+    if status in MISSING_STATUS:
+        negative.add(url)
+    if data:
+        received(len(data))
+    return data or None
 
 
+def save_response(response, filename, head=b""):
+    """
+    @desc:  Stream a response body to filename in CHUNK_SIZE pieces through
+            a temporary file, so an interrupted download never leaves a
+            partial file behind; head is the start of the body when it has
+            been read already. Return the number of bytes written.
+    """
+    fd, tmpfile = tempfile.mkstemp(
+        prefix=".", suffix=".tmp", dir=os.path.dirname(filename)
+    )
+    size = len(head)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(head)
+            while True:
+                chunk = response.read(conf.CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                size += len(chunk)
+                received(len(chunk))
+        if size:
+            os.chmod(tmpfile, 0o666 & ~UMASK)
+            os.replace(tmpfile, filename)
+    finally:
+        if os.path.exists(tmpfile):
+            os.remove(tmpfile)
+    return size
+
+
+def download(url, filename):
+    """
+    @desc:  Save url to filename, return the last HTTP status received
+            (None if the server could not be reached)
+    """
+    if url in negative:
+        return 404
+    (status, size) = request(
+        url,
+        {"User-Agent": randomAgent()},
+        lambda response: save_response(response, filename),
+    )
+    if status in MISSING_STATUS:
+        negative.add(url)
+    return status
+
+
+@metrics.timed("wget")
 def wget(filepath):
     url = "%s%s" % (target.TARGET_GIT_URL, filepath)
-    filename = os.path.join(paths.GITHACK_DIST_TARGET_GIT_PATH, filepath)
+    filename = os.path.join(target.TARGET_GIT_PATH, filepath)
     dirname = os.path.dirname(filename)
     if not os.path.exists(dirname):
-        os.makedirs(dirname)
-    data = request_data(url)
-    if data:
-        writeFile(filename, data)
-        if DEBUG:
-            logger.success("Get %s => %s" % (url, filepath))
+        os.makedirs(dirname, exist_ok=True)
+    status = download(url, filename)
+    if DEBUG and os.path.exists(filename):
+        logger.success("Get %s => %s" % (url, filepath))
+    return status
+
+
+def fetch(filepath, limit):
+    """
+    @desc:  (status, body) of a file of the target, the body is kept in
+            memory unless it is larger than limit bytes: it is then
+            streamed to its place under .git and body is None. A body
+            without Content-Length leaves memory once it passes limit.
+    """
+    url = "%s%s" % (target.TARGET_GIT_URL, filepath)
+    if url in negative:
+        return 404, None
+
+    def to_disk(response, head=b""):
+        filename = os.path.join(target.TARGET_GIT_PATH, filepath)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        save_response(response, filename, head)
+        return None
+
+    def consume(response):
+        length = response.getheader("Content-Length") or ""
+        if length.isdigit() and int(length) > limit:
+            return to_disk(response)
+        chunks = []
+        size = 0
+        while True:
+            chunk = response.read(conf.CHUNK_SIZE)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size += len(chunk)
+            received(len(chunk))
+            if size > limit:
+                return to_disk(response, b"".join(chunks))
+        return b"".join(chunks) or None
+
+    (status, data) = request(url, {"User-Agent": randomAgent()}, consume)
+    if status in MISSING_STATUS:
+        negative.add(url)
+    return status, data
+
+
+class LinkParser(html.parser.HTMLParser):
+    """
+    @desc: Collect the <a href> targets of a directory listing page
+           (Apache, nginx, IIS, Tomcat...) while the page is fed to it
+    """
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.links = []
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "a":
+            href = dict(attrs).get("href")
+            if href:
+                self.links.append(href)
+
+
+def list_directory(url):
+    """
+    @desc:  Links of a directory listing page, parsed as the page streams
+            in; None if the page could not be fetched
+    """
+    if url in negative:
+        return None
+
+    def consume(response):
+        parser = LinkParser()
+        decoder = codecs.getincrementaldecoder("utf-8")("replace")
+        while True:
+            chunk = response.read(conf.CHUNK_SIZE)
+            if not chunk:
+                break
+            received(len(chunk))
+            parser.feed(decoder.decode(chunk))
+        parser.feed(decoder.decode(b"", final=True))
+        parser.close()
+        return parser.links
+
+    (status, links) = request(url, {"User-Agent": randomAgent()}, consume)
+    if status in MISSING_STATUS:
+        negative.add(url)
+    return links
 
 
 def isdirlist():
@@ -64,7 +692,7 @@ def isdirlist():
     data = request_data(target.TARGET_GIT_URL)
 
     if isinstance(data, bytes):
-        data = data.decode()
+        data = data.decode("utf-8", "replace")
 
     if data:
         for key in keywords:
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import fnmatch
+import heapq
+import itertools
+import threading
+import time
+from lib.graph import BLOB
+
+# tiers of the walk: the tree of HEAD, then everything else
+TIER_HEAD = 0
+TIER_HISTORY = 1
+
+
+def split_patterns(value):
+    """
+    "*.php|*.env,config*" -> ["*.php", "*.env", "config*"]
+    """
+    if not value:
+        return []
+    return [p.strip() for p in value.replace(",", "|").split("|") if p.strip()]
+
+
+class PathFilter(object):
+    """
+    @desc: Glob patterns matched against a path relative to the working
+           tree and against its file name, "config*" matches app/config.php
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __call__(self, path):
+        name = path.rsplit("/", 1)[-1]
+        return any(
+            fnmatch.fnmatchcase(path, p) or fnmatch.fnmatchcase(name, p)
+            for p in self.patterns
+        )
+
+
+class Budget(object):
+    """
+    @desc: Time and bytes a dump may spend, 0 is no limit. Once either is
+           spent no new fetch is started; what is left stays pending in
+           the journal for a later run.
+    """
+
+    def __init__(self, seconds=0, size=0):
+        self.seconds = seconds
+        self.size = size
+        self.started = time.monotonic()
+        self.received = 0
+        self.lock = threading.Lock()
+
+    def add(self, size):
+        with self.lock:
+            self.received += size
+
+    def exhausted(self):
+        if self.seconds and time.monotonic() - self.started >= self.seconds:
+            return True
+        return bool(self.size) and self.received >= self.size
+
+
+class Scheduler(object):
+    """
+    @desc: Priority queue of the objects the graph walk has to fetch. The
+           tree of HEAD comes first, then the other commits newest first,
+           each followed by its own tree. Blobs whose path matches the
+           priority patterns come before the other blobs of their commit,
+           and with "only" patterns the other blobs are not fetched at all.
+    """
+
+    def __init__(self, priority=(), only=()):
+        self.priority = PathFilter(priority)
+        self.only = PathFilter(only)
+        self.heap = []
+        self.order = itertools.count()
+        self.skipped = 0
+
+    def __len__(self):
+        return len(self.heap)
+
+    def push(
+        self, objhash, objtype=None, tier=TIER_HEAD, when=0, path=None, urgent=False
+    ):
+        """
+        @desc:  Queue an object, path is None when not known (commits, or
+                objects resumed from the journal). Urgent objects go before
+                everything else, in the order they are pushed. Return False
+                when the object is filtered out.
+        """
+        if objtype == BLOB and path is not None:
+            if self.only and not self.only(path):
+                self.skipped += 1
+                return False
+            rank = 0 if self.priority and self.priority(path) else 1
+        else:
+            # trees and commits lead to the blobs, they never wait behind them
+            rank = 0
+        if urgent:
+            key = (-1, 0, 0, next(self.order))
+        else:
+            key = (tier, -when, rank, next(self.order))
+        heapq.heappush(self.heap, (key, objhash, (objtype, tier, when, path)))
+        return True
+
+    def pop(self):
+        """
+        @desc:  (objhash, (type, tier, when, path)) of the most urgent object
+        """
+        (_, objhash, meta) = heapq.heappop(self.heap)
+        return objhash, meta
@@ -11,6 +11,77 @@ from lib import __version__
 
 DEBUG = False
 
+# Default number of concurrent object fetch workers
+THREADS = 10
+
+# Targets dumped at the same time in batch mode (--list)
+JOBS = 4
+
+# Requests in flight at once across every target
+MAX_REQUESTS = 64
+
+# Blobs fetched before the others of their commit (--priority), globs
+# matched against the path and the file name
+PRIORITY_PATHS = "*.php|*.env|config*|*.sql"
+
+# Targets checked at the same time in probe mode (--probe)
+PROBE_JOBS = 500
+
+# Timeout (seconds) of a single probe request
+PROBE_TIMEOUT = 5
+
+# Socket timeout (seconds) of a single HTTP request
+TIMEOUT = 10
+
+# Maximum number of redirects followed by a single request
+MAX_REDIRECTS = 5
+
+# Attempts made for a request failing with a transient error
+RETRIES = 3
+
+# Exponential backoff between attempts: base delay and upper bound (seconds)
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+
+# Longest Retry-After (seconds) honoured on 429/503
+RETRY_AFTER_MAX = 120
+
+# Seconds a definite 404 is remembered before the path is requested again
+NEGATIVE_CACHE_TTL = 24 * 60 * 60
+
+# Size of the chunks a download is streamed to disk with
+CHUNK_SIZE = 64 * 1024
+
+# Bytes of inflated pack objects kept around as delta bases
+PACK_CACHE_SIZE = 32 * 1024 * 1024
+
+# Bytes of inflated commits and trees kept in memory by the object store
+OBJECT_CACHE_SIZE = 64 * 1024 * 1024
+
+# Loose objects up to this size are downloaded to memory and written to
+# disk in the background, larger ones are streamed straight to disk
+OBJECT_MEMORY_LIMIT = 1024 * 1024
+
+# Downloaded bytes waiting to be written before fetches write them themselves
+OBJECT_UNSAVED_SIZE = 64 * 1024 * 1024
+
+# Byte ranges closer than this are fetched with a single Range request
+RANGE_MERGE_GAP = 16 * 1024
+
+# Delta compression of --repack-deltas: blobs tried as bases of each blob,
+# longest chain of deltas, and blobs larger than this are stored whole
+DELTA_WINDOW = 10
+DELTA_DEPTH = 50
+DELTA_MAX_SIZE = 1024 * 1024
+
+# Upper bounds (seconds) of the buckets of the request latency and phase
+# duration histograms (--metrics, --metrics-port)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PHASE_BUCKETS = (0.001, 0.01, 0.1, 1, 10, 60, 300, 1800, 3600)
+
+# Address the Prometheus endpoint of --metrics-port listens on
+METRICS_HOST = "127.0.0.1"
+
 VERSION = __version__
 
 BANNER = r"""
@@ -25,7 +96,48 @@ BANNER = r"""
 )
 
 USAGE = """Usage:
-  python GitHack.py http://www.target.com/.git/
-"""
+  python GitHack.py [options] http://www.target.com/.git/
+  python GitHack.py [options] -l targets.txt
+  python GitHack.py --probe [-o report.json] -l targets.txt
+
+Options:
+  -t, --threads N   number of concurrent fetch workers (default: %d)
+  -r, --range       fetch only the needed objects of remote packs with
+                    HTTP Range requests instead of whole packs
+  --chunk-size N    bytes per chunk when streaming downloads to disk
+                    (default: %d)
+  --rate N          at most N requests per second to a host (default: no limit)
+  -l, --list FILE   dump every url of FILE, one per line (- for stdin)
+  -j, --jobs N      number of targets dumped at the same time (default: %d,
+                    %d with --probe)
+  --max-requests N  requests in flight at once over all targets (default: %d)
+  --priority GLOBS  blobs fetched first (default: "%s")
+  --only GLOBS      fetch and check out only the files matching GLOBS
+  --max-time N      stop fetching a target after N seconds
+  --max-bytes N     stop fetching a target after N bytes received
+  --export MODE     after the dump, rebuild every commit from the objects:
+                    "tree" writes each commit's files to dist/<target>.history,
+                    "fast-import" writes dist/<target>.history.fi for
+                    "git fast-import"
+  --repack          after the dump, move the loose objects into a single
+                    verified pack and remove them
+  --repack-deltas   like --repack, storing similar blobs as deltas
+  --metrics FILE    write request counts by status, latency histograms,
+                    bytes received, objects by type and time per phase as
+                    JSON to FILE at exit
+  --metrics-port N  serve the same metrics in the Prometheus text format on
+                    http://%s:N/metrics while running
+  --probe           only check which targets expose .git (HEAD, config,
+                    index) and write a ranked JSON report, dump nothing
+  -o, --output FILE report of --probe (default: dist/probe.json, - for stdout)
+""" % (
+    THREADS,
+    CHUNK_SIZE,
+    JOBS,
+    PROBE_JOBS,
+    MAX_REQUESTS,
+    PRIORITY_PATHS,
+    METRICS_HOST,
+)
 
-DEPENDS = """git was not found in $PATH"""
+DEPENDS = """git was not found in $PATH, skip cloning with git"""
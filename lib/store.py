@@ -0,0 +1,282 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import binascii
+import collections
+import io
+import os
+import threading
+import zlib
+from lib import metrics
+from lib.common import ThreadPool
+from lib.data import (
+    logger,
+    target,
+)
+from lib.graph import BLOB
+from lib.journal import (
+    CORRUPT,
+    MISSING,
+    OK,
+)
+from lib.objects import (
+    decode_object,
+    peek_type,
+)
+from lib.repo import write_atomic
+from lib.request import fetch
+from lib.settings import (
+    DEBUG,
+    OBJECT_CACHE_SIZE,
+    OBJECT_MEMORY_LIMIT,
+    OBJECT_UNSAVED_SIZE,
+)
+
+
+class ObjectStore(object):
+    """
+    Loose objects of a dump, shared by the graph walk, the checkout and
+    the local analysis. A downloaded object is handed over from memory,
+    it is written to .git/objects by a background worker; inflated
+    commits, trees and tags are kept in a size-bounded LRU so an object
+    reached again is neither read from disk nor inflated twice.
+    """
+
+    def __init__(self, gitdir, cache_size=OBJECT_CACHE_SIZE):
+        self.gitdir = gitdir
+        self.cache = collections.OrderedDict()
+        self.cache_bytes = 0
+        self.cache_size = cache_size
+        # compressed objects not on disk yet
+        self.unsaved = {}
+        self.unsaved_bytes = 0
+        self.lock = threading.Lock()
+        self.write_lock = threading.Lock()
+        self.writer = ThreadPool(max_workers=1)
+        self.futures = set()
+        self.stats = collections.Counter()
+
+    def _count(self, name):
+        with self.lock:
+            self.stats[name] += 1
+
+    def path(self, sha):
+        hexsha = binascii.hexlify(sha).decode()
+        return f"objects/{hexsha[:2]}/{hexsha[2:]}"
+
+    def _cached(self, sha):
+        with self.lock:
+            obj = self.cache.get(sha)
+            if obj is not None:
+                self.cache.move_to_end(sha)
+            return obj
+
+    def remember(self, sha, obj):
+        """
+        @desc:  Keep an inflated (type, data) around, blobs are not kept
+        """
+        if obj[0] == BLOB or len(obj[1]) > self.cache_size:
+            return
+        with self.lock:
+            if sha in self.cache:
+                return
+            self.cache[sha] = obj
+            self.cache_bytes += len(obj[1])
+            while self.cache_bytes > self.cache_size:
+                _, (_, old) = self.cache.popitem(last=False)
+                self.cache_bytes -= len(old)
+
+    def _raw(self, sha, fetch_missing=True):
+        """
+        @desc:  The compressed object: bytes when in memory, the path of
+                its file when on disk, None when it could not be had
+        """
+        with self.lock:
+            data = self.unsaved.get(sha)
+        if data is not None:
+            return data
+        filename = os.path.join(self.gitdir, self.path(sha))
+        if os.path.exists(filename):
+            return filename
+        if not fetch_missing:
+            return None
+        return self._fetch(sha)
+
+    def _fetch(self, sha):
+        relpath = self.path(sha)
+        logger.info(relpath)
+        self._count("fetched")
+        (status, data) = fetch(relpath, OBJECT_MEMORY_LIMIT)
+        journal = target.get("JOURNAL")
+        filename = os.path.join(self.gitdir, relpath)
+        if data is not None:
+            self.save(sha, data)
+            return data
+        if os.path.exists(filename):
+            # too large to be held in memory, streamed to disk
+            if journal:
+                journal.set_file(relpath, OK)
+            return filename
+        if journal and status == 404:
+            journal.set_file(relpath, MISSING)
+        return None
+
+    def save(self, sha, data):
+        """
+        @desc:  Queue the compressed object data to be written to disk; once
+                too much waits, the caller writes it itself
+        """
+        with self.lock:
+            if sha in self.unsaved:
+                return
+            self.unsaved[sha] = data
+            self.unsaved_bytes += len(data)
+            backlog = self.unsaved_bytes > OBJECT_UNSAVED_SIZE
+        if backlog:
+            self._write(sha)
+            return
+        future = self.writer.submit(self._write, sha)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._done)
+
+    def _done(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def _write(self, sha):
+        relpath = self.path(sha)
+        with self.write_lock:
+            with self.lock:
+                data = self.unsaved.get(sha)
+            if data is None:
+                # discarded or written meanwhile
+                return
+            filename = os.path.join(self.gitdir, relpath)
+            try:
+                if not os.path.exists(filename):
+                    with metrics.phase("write"):
+                        write_atomic(filename, data)
+            except OSError as e:
+                logger.warning(f"Write {relpath} Fail: {e}")
+                return
+            finally:
+                with self.lock:
+                    self.unsaved.pop(sha, None)
+                    self.unsaved_bytes -= len(data)
+        self._count("written")
+        if target.get("JOURNAL"):
+            target.JOURNAL.set_file(relpath, OK)
+
+    def put(self, sha, objtype, data):
+        """
+        @desc:  Add an object read from elsewhere (a remote pack)
+        """
+        self.remember(sha, (objtype, data))
+        if not self.has(sha):
+            header = b"%s %d\x00" % (objtype, len(data))
+            self.save(sha, zlib.compress(header + data))
+
+    def has(self, sha):
+        with self.lock:
+            if sha in self.unsaved:
+                return True
+        return os.path.isfile(os.path.join(self.gitdir, self.path(sha)))
+
+    def get(self, sha, blobs=True, fetch_missing=True):
+        """
+        @desc:  (type, data) of a 20-byte sha, None when it is missing or
+                corrupt. With blobs=False the data of a blob is None, only
+                its header is inflated. A corrupt download is discarded so
+                that it is fetched again.
+        """
+        obj = self._cached(sha)
+        if obj is not None:
+            self._count("hits")
+            return obj
+        raw = self._raw(sha, fetch_missing)
+        if raw is None:
+            return None
+        try:
+            if not isinstance(raw, bytes):
+                with open(raw, "rb") as f:
+                    raw = f.read(1024)
+                    # the type of a blob is all the walk needs
+                    if blobs or peek_type(raw) != BLOB:
+                        raw += f.read()
+            with metrics.phase("inflate"):
+                obj = decode_object(raw, blobs)
+            if obj[1] is None:
+                return obj
+        except (zlib.error, ValueError, OSError):
+            if fetch_missing:
+                if DEBUG:
+                    logger.warning(
+                        f"Decompress Object({binascii.hexlify(sha).decode()}) Fail"
+                    )
+                self.discard(sha)
+            return None
+        self._count("inflated")
+        self.remember(sha, obj)
+        return obj
+
+    def open(self, sha, fetch_missing=True):
+        """
+        @desc:  Binary file of the compressed object, to be inflated as a
+                stream; None when it could not be had
+        """
+        raw = self._raw(sha, fetch_missing)
+        if raw is None:
+            return None
+        if isinstance(raw, bytes):
+            return io.BytesIO(raw)
+        return open(raw, "rb")
+
+    def discard(self, sha):
+        """
+        @desc:  Forget a corrupt object, on disk or still in memory
+        """
+        relpath = self.path(sha)
+        with self.write_lock:
+            with self.lock:
+                data = self.unsaved.pop(sha, None)
+                if data is not None:
+                    self.unsaved_bytes -= len(data)
+                self.cache.pop(sha, None)
+            filename = os.path.join(self.gitdir, relpath)
+            if os.path.exists(filename):
+                os.remove(filename)
+        if target.get("JOURNAL"):
+            target.JOURNAL.set_file(relpath, CORRUPT)
+
+    def flush(self):
+        """
+        @desc:  Wait until every downloaded object is on disk
+        """
+        while True:
+            with self.lock:
+                futures = list(self.futures)
+            if not futures:
+                return
+            for future in futures:
+                future.result()
+
+    def close(self):
+        self.flush()
+        self.writer.shutdown()
+        with self.lock:
+            self.cache.clear()
+            self.cache_bytes = 0
+
+    def summary(self):
+        return (
+            f"{self.stats['fetched']} fetched, {self.stats['written']} written, "
+            f"{self.stats['inflated']} inflated, {self.stats['hits']} cache hits"
+        )
+
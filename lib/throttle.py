@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+# coding:utf-8
+
+"""
+Copyright (c) 2017 BugScan (http://www.bugscan.net)
+Copyright (C) 2024 0wnerDied <z1281552865@gmail.com>
+See the file 'LICENCE' for copying permission
+"""
+
+import collections
+import email.utils
+import random
+import threading
+import time
+from lib.data import (
+    conf,
+    logger,
+)
+from lib.settings import (
+    BACKOFF_BASE,
+    BACKOFF_MAX,
+    DEBUG,
+    RETRY_AFTER_MAX,
+)
+
+# transient failures which are worth another attempt, None is a
+# connection error or a timeout
+RETRY_STATUS = (None, 408, 425, 429, 500, 502, 503, 504)
+
+# the server asks us to slow down
+THROTTLE_STATUS = (None, 429, 503)
+
+stats = collections.Counter()
+stats_lock = threading.Lock()
+
+
+def count(name):
+    with stats_lock:
+        stats[name] += 1
+
+
+class TokenBucket(object):
+    """
+    @desc: Allow rate requests per second on average, bursts up to burst
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.capacity = float(burst or max(1, rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(
+                    self.capacity, self.tokens + (now - self.updated) * self.rate
+                )
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+
+class HostLimiter(object):
+    """
+    @desc: Requests in flight to one host. The concurrency limit adapts
+           to the server (additive increase, multiplicative decrease):
+           it is halved whenever the host throttles or drops requests and
+           grows by one after a full window of successes. Workers block
+           in acquire() while the host is at its limit or cooling down.
+    """
+
+    def __init__(self, host, limit, rate=0):
+        self.host = host
+        self.max_limit = max(1, limit)
+        self.limit = self.max_limit
+        self.inflight = 0
+        self.successes = 0
+        self.resume_at = 0
+        self.cond = threading.Condition()
+        self.bucket = TokenBucket(rate) if rate else None
+
+    def acquire(self):
+        with self.cond:
+            while self.inflight >= self.limit:
+                self.cond.wait()
+            self.inflight += 1
+            delay = self.resume_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        if self.bucket is not None:
+            self.bucket.acquire()
+        # taken last, so that no global slot is held while waiting on the host
+        slots().acquire()
+
+    def release(self, status, local=False):
+        """
+        @desc:  A request is over, status is None when the host could not
+                be reached; a local failure does not count for the host
+        """
+        slots().release()
+        with self.cond:
+            self.inflight -= 1
+            self.cond.notify_all()
+            if local:
+                return
+            if status in THROTTLE_STATUS:
+                if self.limit > 1:
+                    self.limit = max(1, self.limit // 2)
+                    if DEBUG:
+                        logger.warning(f"{self.host} concurrency down to {self.limit}")
+                self.successes = 0
+            elif status < 500:
+                self.successes += 1
+                if self.successes >= self.limit and self.limit < self.max_limit:
+                    self.limit += 1
+                    self.successes = 0
+
+    def cooldown(self, seconds):
+        """
+        @desc:  Hold every request to the host for seconds (Retry-After)
+        """
+        with self.cond:
+            self.resume_at = max(self.resume_at, time.monotonic() + seconds)
+
+
+limiters = {}
+limiters_lock = threading.Lock()
+_slots = None
+
+
+def slots():
+    """
+    @desc:  Semaphore bounding the requests in flight over every host
+    """
+    global _slots
+    if _slots is None:
+        with limiters_lock:
+            if _slots is None:
+                _slots = threading.BoundedSemaphore(conf.MAX_REQUESTS)
+    return _slots
+
+
+def limiter(host):
+    with limiters_lock:
+        if host not in limiters:
+            limiters[host] = HostLimiter(host, conf.THREADS, conf.RATE)
+        return limiters[host]
+
+
+def retry_after(value):
+    """
+    @desc:  Seconds to wait from a Retry-After header (delay or HTTP date)
+    """
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        seconds = int(value)
+    else:
+        try:
+            seconds = email.utils.parsedate_to_datetime(value).timestamp() - time.time()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0), RETRY_AFTER_MAX)
+
+
+def backoff(attempt):
+    """
+    @desc:  Exponential backoff with full jitter
+    """
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+
+
+def summary():
+    limits = ", ".join(
+        f"{h.host} {h.limit}/{h.max_limit}" for h in list(limiters.values())
+    )
+    return "Retries: %d, throttled: %d, concurrency: %s" % (
+        stats["retries"],
+        stats["throttled"],
+        limits or "-",
+    )